@@ -0,0 +1,198 @@
+#!/usr/bin/python
+
+# --------------------------------------------------------------------------
+# Clock-synchronized presentations on several devices (Pis) over UDP.
+#
+# One node is the time master, all others are followers. Followers measure
+# the offset of their monotonic clock to the master's with PTP-style
+# exchanges (t1: request sent, t2: master received, t3: master replied,
+# t4: reply received):
+#   offset = ((t2 - t1) + (t3 - t4)) / 2,   delay = (t4 - t1) - (t3 - t2)
+# and keep the offset of the exchange with the lowest delay among the recent
+# ones (smoothed), which rejects samples delayed by the network or the
+# scheduler. Instead of free-running with their own fix_time, all nodes start
+# their cycles at agreed absolute times on the master clock:
+#   onset of cycle n = epoch + n * period
+# Every node reports the measured onset of each cycle to the master, which
+# logs the inter-device onset error.
+#
+# Datagrams that are not sync messages (e.g. sync events sent to the same
+# port) are ignored.
+#
+# Test on one box with loopback networking (the offset simulates a clock
+# that is off by 37 ms):
+#   python clock_sync.py master
+#   python clock_sync.py follower 127.0.0.1 --offset 0.037
+# --------------------------------------------------------------------------
+
+import sys
+import json
+import time
+import socket
+import collections
+from monotonic_clock import monotonic, sleep_until
+from realtime_mode import background_thread
+
+
+# Clock offset (other - own) and round-trip delay [s] of one exchange
+def offset_and_delay(t1, t2, t3, t4):
+    return ((t2 - t1) + (t3 - t4)) / 2.0, (t4 - t1) - (t3 - t2)
+
+
+class ClockSync(object):
+    # role: 'master' or 'follower', period: cycle length [s] (master only,
+    # followers learn it from the master), clock_offset: added to the local
+    # clock (only to simulate unsynchronized clocks in tests)
+    def __init__(self, role, master_host='127.0.0.1', port=5005, period=0.25, node_name=None,
+            onset_log=None, sync_interval=0.2, n_samples=16, clock_offset=0.0):
+        assert(role in ('master', 'follower'))
+        self.role = role
+        self.master = (master_host, port)
+        self.port = port
+        self.period = period
+        self.node_name = node_name or socket.gethostname() + ':' + role
+        self.onset_log = onset_log
+        self.sync_interval = sync_interval
+        self.clock_offset = clock_offset
+        self.offset = 0.0   # master clock - local clock [s]
+        self.delay = None   # round-trip delay of the best recent exchange [s]
+        self.synced = (role == 'master')
+        self.epoch = None
+        self._samples = collections.deque(maxlen=n_samples)
+        self._master_onsets = collections.OrderedDict() # cycle -> onset (master only)
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        if role == 'master':
+            self._sock.bind(('', port))
+            self.epoch = self.now() + 1.0
+        else:
+            self._sock.settimeout(0.5)
+
+    # local monotonic clock (plus the simulated offset)
+    def now(self):
+        return monotonic() + self.clock_offset
+
+    def to_master(self, local_time):
+        return local_time + self.offset
+
+    def to_local(self, master_time):
+        return master_time - self.offset
+
+    def start(self, timeout=10.0):
+        target = self._serve if self.role == 'master' else self._discipline
+        thread = background_thread(target)
+        thread.start()
+        if self.role == 'follower': # wait for the first offset and the schedule
+            deadline = monotonic() + timeout
+            while not self.synced and monotonic() < deadline:
+                time.sleep(0.01)
+            if not self.synced:
+                raise RuntimeError('No answer from sync master at ' + str(self.master))
+
+    # Master: answer sync requests and collect onset reports
+    def _serve(self):
+        while True:
+            data, address = self._sock.recvfrom(2048)
+            t2 = self.now()
+            try:
+                message = json.loads(data.decode('utf-8'))
+                if message['type'] == 'sync':
+                    reply = {'type': 'sync_reply', 't1': message['t1'], 't2': t2,
+                        'epoch': self.epoch, 'period': self.period}
+                    reply['t3'] = self.now()
+                    self._sock.sendto(json.dumps(reply).encode('utf-8'), address)
+                elif message['type'] == 'report':
+                    self._log_onset(message['node'], message['cycle'], message['onset'])
+            except (ValueError, KeyError, TypeError, socket.error):
+                pass # not a sync message (or the sender is gone): ignore it
+
+    # Follower: exchange timestamps with the master and update the offset
+    def _discipline(self):
+        while True:
+            t1 = self.now()
+            request = json.dumps({'type': 'sync', 't1': t1}).encode('utf-8')
+            try:
+                self._sock.sendto(request, self.master)
+                data = self._sock.recv(2048)
+            except socket.error:
+                time.sleep(self.sync_interval)
+                continue
+            t4 = self.now()
+            try:
+                reply = json.loads(data.decode('utf-8'))
+                if reply.get('type') != 'sync_reply' or reply['t1'] != t1:
+                    continue # late reply to an earlier request
+                offset, delay = offset_and_delay(t1, reply['t2'], reply['t3'], t4)
+            except (ValueError, KeyError, TypeError, AttributeError):
+                continue # not a sync reply
+            self._samples.append((delay, offset))
+            best_delay, best_offset = min(self._samples)
+            if not self.synced:
+                self.offset = best_offset
+            else:
+                self.offset += 0.3 * (best_offset - self.offset) # smooth out small jumps
+            self.delay = best_delay
+            self.epoch = reply['epoch']
+            self.period = reply['period']
+            self.synced = True
+            time.sleep(self.sync_interval)
+
+    # Next cycle on the master clock that is at least min_lead away.
+    # Returns the cycle number and its onset on the local clock.
+    def next_cycle(self, min_lead=0.002):
+        master_now = self.to_master(self.now())
+        cycle = max(0, int((master_now - self.epoch) / self.period) + 1)
+        if self.epoch + cycle * self.period - master_now < min_lead:
+            cycle += 1
+        return cycle, self.to_local(self.epoch + cycle * self.period)
+
+    # Same as next_cycle, but also waits for the onset
+    def wait_next_cycle(self, min_lead=0.002):
+        cycle, onset = self.next_cycle(min_lead)
+        sleep_until(onset - self.clock_offset)
+        return cycle, onset
+
+    # Tell the master when a cycle actually started (local clock)
+    def report_onset(self, cycle, local_onset):
+        master_onset = self.to_master(local_onset)
+        if self.role == 'master':
+            self._log_onset(self.node_name, cycle, master_onset)
+        else:
+            report = {'type': 'report', 'node': self.node_name, 'cycle': cycle, 'onset': master_onset}
+            try:
+                self._sock.sendto(json.dumps(report).encode('utf-8'), self.master)
+            except socket.error:
+                pass
+
+    # Master: log the onset error against the schedule and against the master
+    def _log_onset(self, node, cycle, master_onset):
+        scheduled = self.epoch + cycle * self.period
+        if node == self.node_name:
+            self._master_onsets[cycle] = master_onset
+            while len(self._master_onsets) > 100:
+                self._master_onsets.popitem(last=False)
+        line = node + ',' + str(cycle) + ',' + ('%.3f' % ((master_onset - scheduled) * 1000))
+        if node != self.node_name and cycle in self._master_onsets:
+            line += ',' + ('%.3f' % ((master_onset - self._master_onsets[cycle]) * 1000))
+        else:
+            line += ','
+        if self.onset_log:
+            with open(self.onset_log, 'a') as f:
+                f.write(line + '\n')
+        elif node != self.node_name:
+            print('Sync: node,cycle,error to schedule [ms],error to master [ms]: ' + line)
+
+
+if __name__ == '__main__':
+    # dummy presentation loop to test synchronization on one box
+    role = sys.argv[1]
+    host = sys.argv[2] if len(sys.argv) > 2 and not sys.argv[2].startswith('--') else '127.0.0.1'
+    offset = float(sys.argv[sys.argv.index('--offset')+1]) if '--offset' in sys.argv else 0.0
+    sync = ClockSync(role, host, clock_offset=offset, node_name=role + str(offset))
+    sync.start()
+    while True:
+        cycle, onset = sync.wait_next_cycle()
+        sync.report_onset(cycle, sync.now())
+        if role == 'follower' and cycle % 20 == 0:
+            print('cycle ' + str(cycle) + ': offset=' + ('%.3f' % (sync.offset*1000)) +
+                ' ms, delay=' + ('%.3f' % (sync.delay*1000)) + ' ms')
+        time.sleep(0.05) # the presentation would run here
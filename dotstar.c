@@ -444,7 +444,11 @@ static void raw_write(DotStarObject *self, uint8_t *ptr, uint32_t len) {
 		xfer[2].speed_hz = self->bitrate;
 		xfer[1].tx_buf   = (unsigned long)ptr;
 		xfer[1].len      = len;
-		if(self->numLEDs) xfer[2].len = (self->numLEDs + 15) / 16;
+		// Footer only needs to clock the data through the pixels that
+		// were sent; a shorter (truncated) buffer leaves the rest of
+		// the strip as it is, so the footer shrinks along with it.
+		if(self->numLEDs && (self->numLEDs < len / 4))
+		                  xfer[2].len = (self->numLEDs + 15) / 16;
 		else              xfer[2].len = ((len / 4) + 15) / 16;
 		if((xfer[0].len + xfer[1].len + xfer[2].len) <= _bufsiz) {
 			// All that spi_ioc_transfer struct stuff earlier
@@ -474,8 +478,9 @@ static void raw_write(DotStarObject *self, uint8_t *ptr, uint32_t len) {
 		              headerLen = 32;
 		uint32_t      footerLen;
 		turboOn();
-		if(self->numLEDs) footerLen = (self->numLEDs + 1) / 2;
-		else              footerLen = ((len / 4) + 1) / 2;
+		if(self->numLEDs && (self->numLEDs < len / 4))
+		                  footerLen = (self->numLEDs + 1) / 2;
+		else              footerLen = ((len / 4) + 1) / 2; // also for truncated buffers
 		*gpioClr = self->dataMask;
 		while(headerLen--) clockPulse(self);
 		while(len--) { // Pixel data
@@ -496,6 +501,8 @@ static void raw_write(DotStarObject *self, uint8_t *ptr, uint32_t len) {
 // (else object's pixel buffer is used).  If passing raw data, it must
 // be in strip-ready format (4 bytes/pixel, 0xFF/B/G/R) and no brightness
 // scaling is performed...it's all about speed (for POV, etc.)
+// Raw data may be shorter than the strip: only the first len/4 pixels
+// are updated, the others keep their colors.
 static PyObject *show(DotStarObject *self, PyObject *arg) {
 	if(PyTuple_Size(arg) == 1) { // Raw bytearray passed
 		Py_buffer buf;
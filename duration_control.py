@@ -0,0 +1,59 @@
+#!/usr/bin/python
+
+# --------------------------------------------------------------------------
+# Closed-loop compensation of the sweep overshoot.
+#
+# A sweep checks the deadline before every dither/show, so it always ends
+# with one dither and show past the deadline, followed by clear and show.
+# The measured presentation duration (last entry of frame_times) therefore
+# exceeds the requested one by roughly half a show plus the clearing show,
+# which depends on the transfer cost of the strip.
+#
+# The controller keeps a trim per strip that is subtracted from the
+# deadline of the sweep:
+# - calibration: at startup, dark sweeps of the loaded stimulus on every
+#   strip (see priming.py) give the initial trim (median overshoot)
+# - running: after every presentation, trim += gain * (measured - requested)
+# The trim is kept below half the requested duration, so that very short
+# presentations still get a sweep.
+# The residual errors (measured - requested, with compensation) are kept for
+# the statistics printed in the iteration feedback.
+# --------------------------------------------------------------------------
+
+import math
+import collections
+
+
+class DurationController(object):
+    def __init__(self, n_strips, gain=0.2, n_history=200):
+        self.gain = gain
+        self.trims = [0.0] * n_strips # [s] subtracted from the requested duration
+        self.errors = [collections.deque(maxlen=n_history) for k in range(n_strips)] # measured - requested [s]
+
+    # Deadline to give the sweep of strip k for a requested duration [s]
+    def sweep_dur(self, k, dur):
+        return dur - min(self.trims[k], dur / 2)
+
+    # Feed back the measured presentation duration [s]
+    def update(self, k, dur, measured):
+        error = measured - dur
+        self.errors[k].append(error)
+        self.trims[k] = min(dur / 2, max(0.0, self.trims[k] + self.gain * error))
+
+    # Initial trim from n_sweeps uncompensated sweeps. sweep(dur) must run
+    # one presentation and return its measured duration [s].
+    def calibrate(self, k, sweep, dur, n_sweeps=20):
+        overshoots = sorted(sweep(dur) - dur for i in range(n_sweeps))
+        self.trims[k] = min(dur / 2, max(0.0, overshoots[len(overshoots) // 2]))
+        return self.trims[k]
+
+    # Residual error of strip k: mean, standard deviation and 95th percentile
+    # of the absolute error [ms]
+    def residual_stats(self, k):
+        errors = list(self.errors[k])
+        if not errors:
+            return [0.0, 0.0, 0.0]
+        mean = sum(errors) / len(errors)
+        sd = math.sqrt(sum((e - mean) ** 2 for e in errors) / len(errors))
+        p95 = sorted(abs(e) for e in errors)[int(0.95 * (len(errors) - 1))]
+        return [round(mean * 1000, 3), round(sd * 1000, 3), round(p95 * 1000, 3)]
@@ -0,0 +1,190 @@
+#!/usr/bin/python
+
+# --------------------------------------------------------------------------
+# Frame banks: precomputed, strip-ready columns of a LightPaint stimulus.
+#
+# A frame bank is a 2D uint8 array of shape (n_columns, n_leds*4), where
+# every row holds the exact bytes that LightPaint.dither() writes into the
+# LED buffer for that column (0xFF/B/G/R per pixel, in strip color order).
+# Rows can be passed directly to strip.show(), so a sweep from a frame bank
+# does no image processing at all. Banks can live in shared memory, so that
+# worker processes (see strip_workers.py) can read them without copies.
+#
+# A bank can also hold several temporally dithered frames per column, as an
+# array of shape (n_phases, n_columns, n_leds*4). Shows that repeat a column
+# (more shows than columns) then cycle through its phases, so the eye
+# averages them to intensity levels between the 8-bit steps. This is most
+# useful at low brightness, where brightness_config and the color balance
+# leave only a few levels.
+#
+# Delta writes: DotStar pixels keep their color if the data of a show ends
+# before them, so a column only needs to be sent up to its last lit LED, or
+# up to the last LED lit by the column shown before (whichever is further),
+# starting from the dark strip left by clear(). The lit extent of every
+# column is computed when the bank is made and kept with it (FrameBank),
+# so no sweep has to scan the bank. Sweeps that dither LightPaint objects
+# show by show (run_paint) find the extent of the LED buffer after every
+# dither() instead (delta_column). For sparse stimuli (text) this cuts most
+# of the bytes of a show (dotstar.c sizes the footer to match). Estimate the
+# savings for image files with:
+#
+#   python frame_bank.py stimuli/WHY.png stimuli/2019.png ...
+# --------------------------------------------------------------------------
+
+import sys
+import time
+import multiprocessing
+import numpy as np
+from monotonic_clock import monotonic
+
+delta_writes = True # send every column only up to the last LED that changes (see above)
+
+
+# Position (0..1) that LightPaint.dither() expects for a given column
+def column_position(column, n_cols):
+    if n_cols <= 1:
+        return 0.0
+    return float(column) / (n_cols - 1)
+
+
+# Render every column of a LightPaint object into a frame bank. With
+# n_phases > 1, every column is dithered n_phases times in a row: LightPaint
+# diffuses the quantization error into the next dither() call, so the
+# phases average to its 16-bit gamma-corrected column.
+def make_frame_bank(lightpaint, ledBuffer, n_cols, n_phases=1):
+    n_bytes = len(ledBuffer)
+    bank = np.empty((n_phases, n_cols, n_bytes), dtype=np.uint8)
+    for c in range(n_cols):
+        for p in range(n_phases):
+            lightpaint.dither(ledBuffer, column_position(c, n_cols)) # write column to buffer
+            bank[p, c, :] = np.frombuffer(ledBuffer, dtype=np.uint8) # ... and keep a copy
+    return indexed_bank(bank[0] if n_phases == 1 else bank)
+
+
+# Number of dither phases and of columns of a bank
+def bank_phases(bank):
+    return bank.shape[0] if bank.ndim == 3 else 1
+
+
+def bank_width(bank):
+    return bank.shape[-2]
+
+
+# Per column: number of LEDs up to and including the last lit one (in any phase)
+def lit_extents(bank):
+    lit = bank.reshape(bank.shape[:-1] + (-1, 4))[..., 1:].any(axis=-1)
+    if lit.ndim == 3:
+        lit = lit.any(axis=0)
+    extents = lit.shape[1] - np.argmax(lit[:, ::-1], axis=1)
+    extents[~lit.any(axis=1)] = 0
+    return [int(e) for e in extents]
+
+
+# The part of an LED buffer to show after dither(), up to the last LED that
+# changes. leds: np.frombuffer() of the buffer, lit: extent of the column
+# shown before. Returns the view to show and the extent of this column.
+def delta_column(leds, lit):
+    lit_leds = leds.view('<u4')[::-1] > 0xFF # B/G/R of the LED (above its header byte) not all zero
+    last = int(np.argmax(lit_leds))
+    extent = len(lit_leds) - last if lit_leds[last] else 0
+    return leds[0:4 * max(extent, lit, 1)], extent
+
+
+# Mean number of LEDs a sweep sends per show (delta writes; all without)
+def sent_leds(bank):
+    extents = getattr(bank, 'extents', None)
+    if not delta_writes or extents is None:
+        return bank.shape[-1] // 4
+    return sum(max(extents[c], extents[c-1] if c > 0 else 0, 1) for c in range(len(extents))) / float(len(extents))
+
+
+# A frame bank that carries the lit extents of its columns. Views of it
+# (slices, reversed columns) do not.
+class FrameBank(np.ndarray):
+    def __array_finalize__(self, obj):
+        self.extents = None
+
+
+# The bank as a FrameBank, with its lit extents (computed if not given)
+def indexed_bank(bank, extents=None):
+    if extents is None:
+        extents = lit_extents(np.asarray(bank))
+    bank = bank.view(FrameBank)
+    bank.extents = extents
+    return bank
+
+
+# Copy a frame bank into shared memory (inherited by forked processes)
+def shared_frame_bank(bank):
+    raw = multiprocessing.RawArray('B', int(bank.size))
+    shared = np.frombuffer(raw, dtype=np.uint8).reshape(bank.shape)
+    shared[:] = bank
+    return indexed_bank(shared, getattr(bank, 'extents', None))
+
+
+# Same as run_paint, but shows the precomputed columns of a frame bank.
+# Timestamps are taken from the shared monotonic clock. With reverse, the
+# columns run from last to first, through a reversed view of the bank (the
+# rows stay contiguous, nothing is copied). Show number n uses dither phase
+# n % n_phases.
+def run_paint_bank(dur, delay, bank, which_strip, reverse=False):
+    phases = bank if bank.ndim == 3 else bank[np.newaxis] # (phase, column, byte)
+    n_phases, n_cols = phases.shape[0], phases.shape[1]
+    if delta_writes:
+        extents = getattr(bank, 'extents', None)
+        if extents is None: # plain array: scan it now
+            extents = lit_extents(np.asarray(bank))
+    else:
+        extents = [phases.shape[2] // 4] * n_cols
+    if reverse:
+        phases = phases[:, ::-1]
+        extents = extents[::-1]
+    lit = 0 # LEDs up to the last lit one on the strip (dark after clear)
+    elapsed = 0 # time elapsed since startTime
+    frame_times = [] # here we'll list the timestamps
+    startTime = monotonic() # time at start of the presentation
+    # step through the columns
+    if dur > 0:
+        while elapsed <= dur:
+            elapsed = monotonic() - startTime
+            column = int(elapsed / dur * n_cols)
+            if column >= n_cols:
+                column = n_cols - 1
+            extent = extents[column]
+            which_strip.show(phases[len(frame_times) % n_phases, column, 0:4 * max(extent, lit, 1)]) # display the column, up to the last LED that changes
+            lit = extent
+            frame_times.append(monotonic() - startTime) # save the timestamp after the 'show' command
+    else:
+        print('Warning! Duration is zero')
+    # remove the display from the strip here
+    which_strip.clear()
+    which_strip.show()
+    break_time = monotonic()
+    frame_times.append(break_time - startTime) # last timestamp of presentation
+    # wait for delay time (no need to timestamp this)
+    sleep_for_time = delay + dur - (break_time - startTime)
+    if sleep_for_time > 0:
+        time.sleep(sleep_for_time)
+    # return the timestamps
+    return frame_times
+
+
+if __name__ == '__main__':
+    # bytes per show with and without delta writes, for image files (the lit
+    # extents are taken from the image pixels, as on a strip with vflip)
+    from PIL import Image
+    from throughput_planner import wire_bits
+    n_leds = 144
+    print('image                      LEDs sent   bits/show (full -> delta)   transfer-bound shows/s gain')
+    for filename in sys.argv[1:]:
+        img = Image.open(filename).convert('RGB')
+        img = img.resize((img.size[0], n_leds), Image.BICUBIC)
+        columns = np.asarray(img, dtype=np.uint8).transpose(1, 0, 2)[:, ::-1] # (width, n_leds, 3), vflip
+        bank = np.zeros((columns.shape[0], n_leds, 4), dtype=np.uint8)
+        bank[:, :, 1:] = columns
+        extents = lit_extents(bank.reshape(columns.shape[0], n_leds * 4))
+        sent = [max(extents[c], extents[c-1] if c > 0 else 0, 1) for c in range(len(extents))]
+        full_bits = wire_bits(n_leds, True)
+        delta_bits = sum(wire_bits(n_leds, True, n) for n in sent) / float(len(sent))
+        print('%-26s %9.1f   %9d -> %-9.0f (%2.0f%%)   x%.2f' % (filename.split('/')[-1], sum(sent) / float(len(sent)),
+            full_bits, delta_bits, 100 * (1 - delta_bits / full_bits), full_bits / delta_bits))
@@ -0,0 +1,47 @@
+#!/usr/bin/python
+
+# --------------------------------------------------------------------------
+# Monotonic clock shared by all processes of the presentation interface.
+#
+# time.clock() is per-process CPU time on Linux: it does not count time spent
+# blocked in the SPI transfer or in sleeps, and it cannot be compared between
+# worker processes. CLOCK_MONOTONIC is system-wide wall time and never jumps,
+# so every sweep (run_paint included) is timed with it and onsets measured in
+# different processes (or by different strips) can be compared directly.
+# Python 2.7 has no time.monotonic(), so we go through librt/libc there.
+# --------------------------------------------------------------------------
+
+import time
+import ctypes
+import ctypes.util
+
+CLOCK_MONOTONIC = 1 # from <linux/time.h>
+
+
+class _timespec(ctypes.Structure):
+    _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+
+
+if hasattr(time, 'monotonic'): # Python 3: already CLOCK_MONOTONIC on Linux
+    monotonic = time.monotonic
+else: # Python 2: call clock_gettime ourselves
+    _librt = ctypes.CDLL(ctypes.util.find_library('rt') or ctypes.util.find_library('c'), use_errno=True)
+    _clock_gettime = _librt.clock_gettime
+    _clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(_timespec)]
+    _ts = _timespec()
+
+    def monotonic():
+        if _clock_gettime(CLOCK_MONOTONIC, ctypes.byref(_ts)) != 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, 'clock_gettime(CLOCK_MONOTONIC) failed')
+        return _ts.tv_sec + _ts.tv_nsec * 1e-9
+
+
+# Sleep until an absolute monotonic time. The last 'spin' seconds are busy-
+# waited, because time.sleep() may overshoot by a scheduler tick.
+def sleep_until(deadline, spin=0.002):
+    remaining = deadline - monotonic()
+    if remaining > spin:
+        time.sleep(remaining - spin)
+    while monotonic() < deadline:
+        pass
@@ -40,6 +40,23 @@ from lightpaint import LightPaint
 from PIL import Image
 import npyscreen # sudo pip install npyscreen
 import keyboard  # sudo pip install keyboard
+import frame_bank
+from frame_bank import run_paint_bank, shared_frame_bank, bank_width, delta_column, FrameBank
+from strip_workers import StripWorkerPool, RES_INTER_FRAME
+from stimulus_registry import StimulusRegistry
+from stimulus_catalog import StimulusCatalog
+from usb_ingest import UsbIngest
+from streaming_columns import ColumnStream, image_width, run_paint_stream, UNLIMITED_POWER
+from procedural_stimuli import is_procedural, make_procedural_bank, parse_spec
+from throughput_planner import calibrate_strip, check_plan, print_plan, predict
+from duration_control import DurationController
+from monotonic_clock import monotonic
+from clock_sync import ClockSync
+from sync_events import SyncEvents, parse_target, wrap_strips
+from priming import DarkStrip, prime, print_priming, show_cost
+from phase_profiler import PhaseProfiler, run_paint_profiled, serve_metrics
+from session_logger import SessionLogger
+from realtime_mode import enter_realtime, leave_realtime, collect_in_gap, benchmark_jitter, inter_show_intervals, get_jitter
 
 
 
@@ -49,18 +66,8 @@ import keyboard  # sudo pip install keyboard
 n_strips = 4 ## the interface is for four LED strips!
 pin_config = [[16, 26], [17, 27], [5, 6], [23, 24]] # [[datapin_1, clockpin_1], [datapin_2, clockpin_2], ...], SPI pins are: 10, 11
 n_leds = [144, 144, 144, 144]
-images = [["TestColourOrder.jpg", "TestColourOrder.jpg", "TestColourOrder.jpg", "TestColourOrder.jpg"], # 0
-    ["WHY.png", "NOT.png", "CARE.png", "LESS.png"],     # 1
-    ["ENJOY.png", "YOUR.png", "BEER.png", "MATE.png"],  # 2
-    ["HER.png", "LOVE.png", "IS.png", "REAL.png"],      # 3
-    ["CAN.png", "YOU.png", "SEE.png", "THIS.png"],      # 4
-    ["VSS.png", "2019.png", "LOVES.png", "YOU.png"],    # 5
-    ["LISA.png", "WON.png", "AN.png", "AWARD.png"],     # 6
-    ["THE.png", "light.jpg", "IS.png", "NICE.png"],     # 7
-    ["cactus.jpg", "usa.jpg", "30.jpg", "Donald-Trump.jpg"],  # 8: picture stimuli
-    ["marge.jpg", "lisa.jpg", "bart.jpg", "homer.jpg"]]        # 9: picture stimuli
-images_default = 0 #  "Check that each LED shows all three colours, Green, Red, Blue"
-n_images = len(images)
+sets_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'stimulus_sets.json') # named image sets, one file per strip
+images_default = 'colour-test' #  "Check that each LED shows all three colours, Green, Red, Blue"
 
 # standard/start values
 brightness_config = [255, 255, 255, 255]
@@ -69,6 +76,13 @@ inter_durs = [1, 1, 1, 1] # in ms
 fix_time = 100 # how much time between iterations?
 start_left = 1 # 1: left-to-right, 0: right-to-left presentation
 presentation_alternating = 0 # 0: always in one direction, 1: alternating directions
+mirror_columns = 0 # 1: right-to-left presentations also show the columns of each image in reverse order
+parallel_strips = 0 # 0: drive all strips from the main loop, 1: one worker process per strip
+worker_cores = [0, 1, 2, 3] # CPU core for the worker of each strip (if parallel_strips == 1)
+realtime_mode = 0 # 1: SCHED_FIFO, locked memory and no garbage collection during sweeps (needs sudo)
+realtime_priority = 50 # SCHED_FIFO priority [1..99]
+jitter_benchmark_sweeps = 0 # >0: at startup, compare inter-show jitter with and without real-time mode
+session_log_path = '' # directory for per-presentation session logs ('': no logging)
     
 # global settings
 image_path = '/home/pi/PersistenceOfVision/pv/NEW PV/stimuli'
@@ -82,9 +96,68 @@ max_dur_slider = 100            # slider maximum presentation duration
 max_brightness_slider = 255     # slider maximum brightness
 WaitForKey_time = 0.1      # in seconds, how much time for detecting a key?
 increase_duration_step = 1  # in milliseconds
+stimulus_keys = [] # registry keys of the stimuli that are currently loaded
+usb_ingest = 0 # 1: hot-load images from USB sticks (SIGUSR1 from 99_lightpaint_mount)
+usb_mount_root = '/media' # where usbmount mounts sticks
+ingest_path = '/home/pi/PersistenceOfVision/pv/NEW PV/stimuli-usb' # local copies of ingested images
+usb_ingester = None # background ingest, started in main
+ingested_files = [] # ingested images that do not fill a complete image set yet
+stream_min_width = 4096 # images at least this wide are processed in tiles while they are shown (0: never)
+stream_tile_cols = 256 # columns per tile
+stream_resident_tiles = 4 # tiles kept in memory per streamed image
+cache_path = '/home/pi/PersistenceOfVision/pv/NEW PV/cache' # generated files: decoded wide images, catalog index (outside image_path)
+profile_phases = 0 # 1: time dither/show/timestamp/clear/gap of every sweep into histograms (serial LightPaint sweeps only)
+metrics_port = 9100 # local HTTP port for the phase histograms (python phase_profiler.py to print them)
+phase_profiler = None # created in main if profile_phases == 1
+unprofiled_strips = set() # strips that were told their sweeps are not profiled
+sync_role = '' # '': free-running with fix_time, 'master' or 'follower': cycles start at times agreed over UDP
+sync_master_host = '192.168.1.10' # address of the sync master (followers only)
+sync_port = 5005 # UDP port of the sync master
+sync_period = 250 # in ms, time between cycle onsets (set by the master, must exceed one iteration)
+sync_onset_log = '' # master: CSV file for the inter-device onset errors ('': print them)
+clock_sync = None # created in main if sync_role is set
+plan_throughput = 1 # 1: calibrate show costs at startup and warn before columns would be skipped
+adapt_display_durs = 0 # 1: also raise display durations until no columns are skipped
+strip_costs = None # calibrated cost model per strip (if plan_throughput == 1)
+planned_config = None # display_durs and img_widths of the last check
+sync_events_target = '' # 'host:port': UDP datagram at onset and offset of every presentation ('': off)
+sync_ttl_pins = [] # BCM pin per strip, TTL high from the first to the last show of a presentation ([]: off)
+sync_events = None # created in main if sync_events_target or sync_ttl_pins is set
+compensate_durations = 1 # 1: end sweeps early by the measured overshoot, so that presentations last display_durs
+duration_calibration_sweeps = 20 # dark sweeps per strip at startup to calibrate the overshoot
+duration_gain = 0.2 # how fast the overshoot correction follows the measured durations
+duration_controller = None # created in main if compensate_durations == 1
+delta_writes = 1 # 1: columns are sent only up to the last LED that changes (sparse stimuli show faster)
+dither_phases = 1 # >1: frame banks (procedural stimuli, strip workers) hold this many temporally dithered
+                  # frames per column, cycled by repeated shows of a column (more levels at low brightness)
+prime_stimuli = 1 # 1: dark sweeps of every newly loaded image set until the cost per show settles (see priming.py)
+priming_tolerance = 0.02 # settled: median cost per show of the last priming_window rounds within 2% of the rounds before
+priming_window = 3 # rounds of sweeps per median
+priming_max_time = 1.5 # in s, priming stops after this time in any case (a warning is printed)
+
+
+## Stimulus catalog
+# index of all stimuli in image_path and the image sets of sets_file (see stimulus_catalog.py),
+# built by load_stimulus_catalog() before anything is shown
+stimulus_catalog = StimulusCatalog(image_path, sets_file, n_leds[0], gamma, color_balance_factors, stream_min_width, cache_path)
+stimulus_registry = StimulusRegistry(image_path, stimulus_catalog) # processed stimuli, shared by strips, sets and presentations
+image_set_names = [] # in the order of the keys 0-9 and the slider
+images = [] # file names of every image set
+n_images = 0
 
 
 ## Aux functions
+
+# Build the stimulus catalog and the image sets from it (sets with missing
+# files are listed, but only refused when they are selected)
+def load_stimulus_catalog():
+    global n_images
+    stimulus_catalog.build(n_strips)
+    image_set_names[:] = stimulus_catalog.set_names()
+    images[:] = [stimulus_catalog.sets[name] for name in image_set_names]
+    n_images = len(images)
+
+
 # Load image, do some conversion and processing as needed before painting.
 def loadImage(filename, strip, npixels, brightness, 
         gamma, color_balance_factors, power_settings, color_order, vflip):
@@ -109,9 +182,7 @@ def loadImage(filename, strip, npixels, brightness,
         strip.setPixelColor(n, 0x010100) # Yellow
         strip.show()
     # make color balance according to intended brightness
-    color_balance = (int(round(brightness*color_balance_factors[0])),
-        int(round(brightness*color_balance_factors[1])), 
-        int(round(brightness*color_balance_factors[2])))
+    color_balance = get_color_balance(brightness, color_balance_factors)
     # Pixel buffer, image size, gamma, color balance and power settings
     # are REQUIRED arguments.  One or two additional arguments may
     # optionally be specified:  "order='gbr'" changes the DotStar LED
@@ -134,23 +205,56 @@ def loadImage(filename, strip, npixels, brightness,
     return lightpaint, imgwidth
 
 
-def run_paint(dur, delay, lightpaint_name, ledBuffer, which_strip):
+# make color balance according to intended brightness
+def get_color_balance(brightness, color_balance_factors):
+    return (int(round(brightness*color_balance_factors[0])),
+        int(round(brightness*color_balance_factors[1])), 
+        int(round(brightness*color_balance_factors[2])))
+
+
+# Open a very wide image as a stream of tiles instead of one LightPaint object
+def loadStream(filename, npixels, brightness):
+    color_balance = get_color_balance(brightness, color_balance_factors)
+    make_lightpaint = lambda pixels, size, tile_balance: LightPaint(pixels, size, gamma, tile_balance,
+        UNLIMITED_POWER, order=color_order, vflip=vflip)
+    stream = ColumnStream(os.path.join(image_path, filename), npixels, make_lightpaint,
+        (gamma, color_balance, power_settings), stream_tile_cols, stream_resident_tiles, cache_path)
+    return stream, stream.width
+
+
+# Frame bank of a procedural stimulus ('gen:...' instead of a file name)
+def loadProcedural(spec, npixels, brightness):
+    color_balance = get_color_balance(brightness, color_balance_factors)
+    return make_procedural_bank(spec, npixels, color_order, gamma, color_balance, vflip, dither_phases)
+
+
+def run_paint(dur, delay, lightpaint_name, ledBuffer, which_strip, reverse=False):
+        if isinstance(lightpaint_name, ColumnStream): # wide image, processed while it is shown
+            return run_paint_stream(dur, delay, lightpaint_name, which_strip, reverse)
+        if isinstance(lightpaint_name, np.ndarray): # procedural stimulus, already a frame bank
+            return run_paint_bank(dur, delay, lightpaint_name, which_strip, reverse)
         elapsed = 0 # time elapsed since startTime
         frame_times = [] # here we'll list the timestamps
-        startTime = time.clock() # time at start of the presentation 
+        leds = np.frombuffer(ledBuffer, dtype=np.uint8) if frame_bank.delta_writes else None
+        lit = 0 # LEDs up to the last lit one on the strip (dark after clear)
+        startTime = monotonic() # time at start of the presentation 
         # interpolate through the frames
         if dur > 0:
             while elapsed <= dur:
-                elapsed   = time.clock() - startTime
-                lightpaint_name.dither(ledBuffer, elapsed / dur) # interpolate the column of the image write to buffer
-                which_strip.show(ledBuffer) # display the buffer
-                frame_times.append(time.clock() - startTime) # save the timestamp after the 'show' command
+                elapsed   = monotonic() - startTime
+                lightpaint_name.dither(ledBuffer, max(0.0, 1.0 - elapsed / dur) if reverse else elapsed / dur) # interpolate the column of the image write to buffer
+                if leds is None:
+                    which_strip.show(ledBuffer) # display the buffer
+                else:
+                    column, lit = delta_column(leds, lit)
+                    which_strip.show(column) # display the buffer, up to the last LED that changes
+                frame_times.append(monotonic() - startTime) # save the timestamp after the 'show' command
         else:
             print 'Warning! Duration is zero'
         # remove the display from the strip here
         which_strip.clear()
         which_strip.show()
-        break_time = time.clock()
+        break_time = monotonic()
         frame_times.append(break_time-startTime) # last timestamp of presentation
         # wait for delay time (no need to timestamp this)
         sleep_for_time = delay+dur-(break_time-startTime)
@@ -160,6 +264,126 @@ def run_paint(dur, delay, lightpaint_name, ledBuffer, which_strip):
         return frame_times
 
 
+# Present strip k once (with phase timing, if the profiler is on)
+def run_paint_strip(k, display_durs, inter_durs, lightpaints, reverse=False):
+    dur, delay = compensated_durs(k, display_durs[k]/1000.0, inter_durs[k]/1000.0)
+    if phase_profiler is not None and not isinstance(lightpaints[k], (ColumnStream, np.ndarray)):
+        frame_times = run_paint_profiled(dur, delay, lightpaints[k], led_buffers[k], strips[k], phase_profiler, k, reverse)
+    else:
+        if phase_profiler is not None and k not in unprofiled_strips:
+            unprofiled_strips.add(k)
+            print('Note: strip ' + str(k+1) + ' shows a frame bank or stream, its sweeps are not profiled')
+        frame_times = run_paint(dur, delay, lightpaints[k], led_buffers[k], strips[k], reverse)
+    if duration_controller is not None:
+        duration_controller.update(k, display_durs[k]/1000.0, frame_times[-1])
+    return frame_times
+
+
+# Sweep deadline and gap [s] of strip k, corrected for the sweep overshoot.
+# The gap takes up the difference, so onset-to-onset times stay the same.
+def compensated_durs(k, dur, delay):
+    if duration_controller is None:
+        return dur, delay
+    sweep_dur = duration_controller.sweep_dur(k, dur)
+    return sweep_dur, delay + dur - sweep_dur
+
+
+# Residual duration error per strip (with compensation): mean, sd, p95 of |error|
+def print_duration_errors(iteration_nr):
+    if duration_controller is not None:
+        print('Iter=' + str(iteration_nr) + ' Duration error mean/sd/p95 [ms]: ' +
+            str([duration_controller.residual_stats(k) for k in range(n_strips)]))
+
+
+# Calibrate the sweep overshoot of every strip with dark sweeps of its loaded
+# stimulus. slots: (strip index, stimulus, display duration [ms]) as for
+# prime_sweeps; the first slot of every strip is used, strips without a slot
+# start without trim.
+def start_duration_control(strips_here, led_buffers_here, slots):
+    global duration_controller
+    if compensate_durations != 1:
+        return
+    duration_controller = DurationController(len(strips_here), duration_gain)
+    for k in range(len(strips_here)):
+        strip_slots = [slot for slot in slots if slot[0] == k]
+        if not strip_slots:
+            print('Strip ' + str(k+1) + ': no stimulus to calibrate the sweep overshoot')
+            continue
+        lightpaint, display_dur = strip_slots[0][1:]
+        dark_strip = DarkStrip(strips_here[k])
+        overshoot = duration_controller.calibrate(k,
+            lambda dur: run_paint(dur, 0, lightpaint, led_buffers_here[k], dark_strip)[-1],
+            display_dur/1000.0, duration_calibration_sweeps)
+        print('Strip ' + str(k+1) + ': sweep overshoot ' + str(round(overshoot*1000, 3)) + ' ms')
+
+
+# Show the columns in reverse order? (for right-to-left presentations, if mirror_columns is on)
+def reverse_columns(start_left_here):
+    return mirror_columns == 1 and start_left_here == 0
+
+
+def is_hardware_spi(pins):
+    return pins[0] == 10 and pins[1] == 11
+
+
+# Number of columns of a stimulus, without loading it (None if unknown)
+def stimulus_width(name):
+    if is_procedural(name):
+        return int(parse_spec(name)[1].get('width', 45))
+    try:
+        return image_width(os.path.join(image_path, name))
+    except IOError:
+        return None
+
+
+# Warn (or adapt) if the durations cannot show all columns of the loaded images.
+# Frame banks among the stimuli are planned with the LEDs they actually send.
+def replan(display_durs, img_widths, stimuli):
+    global planned_config
+    sent = [frame_bank.sent_leds(stimuli[k]) if isinstance(stimuli[k], FrameBank) else None for k in range(len(stimuli))]
+    if strip_costs is None or planned_config == (list(display_durs), list(img_widths), sent):
+        return
+    check_plan(strip_costs, display_durs, img_widths, adapt_display_durs == 1, max_dur_slider, sent)
+    planned_config = (list(display_durs), list(img_widths), sent)
+    for k in range(len(strip_costs)): # dither phases only pay off with spare shows
+        shows_per_column = predict(strip_costs[k], display_durs[k], img_widths[k], sent[k])[0] // max(1, img_widths[k])
+        if dither_phases > 1 and shows_per_column < dither_phases:
+            print('Warning! Strip ' + str(k+1) + ': ~' + str(shows_per_column) + ' shows per column, fewer than ' +
+                str(dither_phases) + ' dither phases')
+
+
+# Dark sweeps of loaded stimuli until the cost per show settles (see priming.py).
+# slots: (strip index, stimulus, display duration [ms]) of every sweep in a round
+def prime_sweeps(strips_here, led_buffers_here, slots, label):
+    if prime_stimuli != 1:
+        return
+    dark_strips = [DarkStrip(strip) for strip in strips_here]
+    prime_round = lambda: [show_cost(run_paint(dur/1000.0, 0, lightpaint, led_buffers_here[k], dark_strips[k]))
+        for k, lightpaint, dur in slots]
+    print_priming(label, prime(prime_round, priming_tolerance, priming_window, priming_max_time))
+
+
+# Dark cycles of freshly started strip workers until the cost per show settles
+def prime_pool(pool, display_durs_here, label):
+    if prime_stimuli != 1:
+        return
+    order = list(range(n_strips))
+    def prime_round():
+        pool.run_cycle(display_durs_here, [0]*n_strips, order, dark=True)
+        return [float(pool.results[k, RES_INTER_FRAME]) for k in order] # [s], not rounded like run_cycle's feedback
+    print_priming(label, prime(prime_round, priming_tolerance, priming_window, priming_max_time))
+
+
+# Emit onset and offset events for every presentation (wraps the strips)
+def start_sync_events(strips_here):
+    global sync_events
+    if not sync_events_target and not sync_ttl_pins:
+        return strips_here
+    sync_events = SyncEvents(parse_target(sync_events_target) if sync_events_target else None, sync_ttl_pins)
+    print('Sync events: UDP to ' + (sync_events_target or '-') + ', TTL on pins ' + str(sync_ttl_pins))
+    return wrap_strips(strips_here, sync_events)
+
+
 def initialize_strips(n_leds_here, pin_config_here):
     strips_here = []
     # how many strips?
@@ -182,6 +406,22 @@ def initialize_strips(n_leds_here, pin_config_here):
     return strips_here
 
 
+def start_session_log():
+    if not session_log_path:
+        return None
+    log_file = os.path.join(session_log_path, time.strftime('session_%Y%m%d_%H%M%S.pvlog'))
+    print('Logging presentations to: ' + log_file)
+    return SessionLogger(log_file)
+
+
+def log_presentation(logger, iteration_nr, display_these_img, k, display_durs, inter_durs, brightness_config,
+        pres_dur, n_shows, onset):
+    if logger is not None:
+        logger.log(iteration_nr, display_these_img, k, images[display_these_img][k],
+            display_durs[k], inter_durs[k], brightness_config[k], start_left,
+            pres_dur, n_shows, onset)
+
+
 def set_brightness(strips_here, brightness_config_here):
     n_strips_here = len(strips_here)
     assert(n_strips_here == len(brightness_config_here))
@@ -215,18 +455,68 @@ def get_lightpaint(images_here, strips_here, n_leds_here, brightness_config_here
     assert(n_strips_here==len(images_here))
     assert(n_strips_here==len(n_leds_here))
     assert(n_strips_here==len(brightness_config_here))
-    # make lightpaint objects
+    # make lightpaint objects (each unique stimulus is only processed once)
     for i in range(n_strips_here):
-        # 
-        lightpaint, img_width = loadImage(images_here[i], strips_here[i], n_leds_here[i], brightness_config_here[i], 
-            gamma, color_balance_factors, power_settings, color_order, vflip)
+        if is_procedural(images_here[i]): # generated, cached by the generator itself
+            bank = loadProcedural(images_here[i], n_leds_here[i], brightness_config_here[i])
+            lightpaints_here.append(bank)
+            img_widths_here.append(bank_width(bank))
+            stimulus_keys.append(None)
+            print('--> Generated stimulus of strip ' + str(i+1) + ': ' + images_here[i])
+            continue
+        params = (n_leds_here[i], brightness_config_here[i], gamma, color_balance_factors, power_settings, color_order, vflip)
+        if stream_min_width > 0 and image_width(os.path.join(image_path, images_here[i])) >= stream_min_width:
+            load = lambda: loadStream(images_here[i], n_leds_here[i], brightness_config_here[i])
+        else:
+            load = lambda: loadImage(images_here[i], strips_here[i], n_leds_here[i], brightness_config_here[i],
+                gamma, color_balance_factors, power_settings, color_order, vflip)
+        lightpaint, img_width, key = stimulus_registry.acquire(images_here[i], params, load)
         # add to list
         lightpaints_here.append(lightpaint)
         img_widths_here.append(img_width)
+        stimulus_keys.append(key)
         print('--> Loaded image of strip ' + str(i+1) + ': ' + images_here[i] + ' (brightness=' + str(brightness_config_here) + ')')
     return lightpaints_here, img_widths_here
 
 
+# Start loading a new set of stimuli: returns the registry keys of the old set,
+# which should be released once the new set is loaded (so shared stimuli stay)
+def begin_stimulus_switch():
+    global stimulus_keys
+    old_keys = stimulus_keys
+    stimulus_keys = []
+    return old_keys
+
+
+# Append images ingested from USB as new image sets (called between iterations)
+def add_ingested_sets():
+    global n_images
+    if usb_ingester is None:
+        return
+    for filename in usb_ingester.poll():
+        if not filename in ingested_files and not any(filename in image_set for image_set in images):
+            ingested_files.append(filename)
+    while len(ingested_files) >= n_strips:
+        images.append(ingested_files[0:n_strips])
+        del ingested_files[0:n_strips]
+        n_images = len(images)
+        image_set_names.append('usb-' + str(n_images-1))
+        stimulus_catalog.add_set(image_set_names[-1], images[-1])
+        print('Added image set ' + str(n_images-1) + ' from USB: ' + str(images[-1]))
+
+
+def get_frame_banks(lightpaints, led_buffers_here):
+    frame_banks_here = [] # precomputed columns in shared memory
+    n_strips_here = len(stimulus_keys)
+    for i in range(n_strips_here):
+        if stimulus_keys[i] is None: # procedural stimulus
+            frame_banks_here.append(shared_frame_bank(lightpaints[i]))
+            continue
+        if isinstance(stimulus_registry.entries[stimulus_keys[i]]['lightpaint'], ColumnStream):
+            raise ValueError('Streamed images (wider than stream_min_width) cannot be used with parallel_strips')
+        frame_banks_here.append(stimulus_registry.frame_bank(stimulus_keys[i], led_buffers_here[i], dither_phases))
+    return frame_banks_here
+
 
 
 ## make form
@@ -237,7 +527,7 @@ class myPVoptions(npyscreen.Form):
         # which test pattern to start?
         self.testPattern = self.add(npyscreen.TitleSlider, lowest = 0, out_of=n_images-1, 
             value = display_these_img,
-            name = "Test pattern [0..9]")
+            name = "Test pattern [0.." + str(n_images-1) + "]")
         # presentation style
 #        self.pres_style = self.add(npyscreen.TitleMultiSelect, max_height=-2, value = [1,], name="Pres style",
 #            values = ["OneDirection", "Alternating"], scroll_exit=True)
@@ -319,6 +609,7 @@ def myPVinterface(*args):
 def checkKeyboard(display_durs, inter_durs, brightness_config, not_pressed_ESC, display_these_img, lightpaints, img_widths):
     # will be set to True if lightpaint shall be switched
     switch_lightpaint = False 
+    shown_img = display_these_img # image set shown so far
     
     # check keyboard here
     try:  # used try so that if user pressed other than the given key error will not be shown
@@ -407,28 +698,127 @@ def checkKeyboard(display_durs, inter_durs, brightness_config, not_pressed_ESC,
         elif keyboard.is_pressed('9'): 
             display_these_img = 9
             switch_lightpaint = True
+        # next / previous image set (also beyond 9)
+        elif keyboard.is_pressed('right'):
+            display_these_img = (display_these_img + 1) % n_images
+            switch_lightpaint = True
+        elif keyboard.is_pressed('left'):
+            display_these_img = (display_these_img - 1) % n_images
+            switch_lightpaint = True
         # do nothing if no key was pressed
         else:
             pass
     except:
         pass  # if user pressed a key other than the given key the loop will not break
     
+    # image sets with missing files (and digits without a set) are not shown
+    if switch_lightpaint == True:
+        try:
+            if display_these_img >= n_images:
+                raise ValueError('There is no image set ' + str(display_these_img) + ' (' + str(n_images) + ' sets)')
+            stimulus_catalog.index_of(image_set_names[display_these_img])
+        except ValueError as e:
+            print(str(e))
+            display_these_img = shown_img
+            switch_lightpaint = False
+
     # if necessary, load new test patterns!
     if switch_lightpaint == True:
-        print('Now display test pattern: ' + str(display_these_img))
+        print('Now display test pattern: ' + str(display_these_img) + ' (' + image_set_names[display_these_img] + ')')
+        old_keys = begin_stimulus_switch()
         lightpaints, img_widths = get_lightpaint(images[display_these_img], strips, n_leds, brightness_config)
+        stimulus_registry.release_all(old_keys)
+        if parallel_strips != 1: # strip workers are primed when they are restarted
+            prime_sweeps(strips, led_buffers, [(k, lightpaints[k], display_durs[k]) for k in range(n_strips)],
+                image_set_names[display_these_img])
     
     # return here
     return display_durs, inter_durs, brightness_config, not_pressed_ESC, display_these_img, lightpaints, img_widths
 
 
 
+def run_parallel_paint(display_durs, inter_durs, brightness_config, display_these_img, lightpaints, img_widths, logger):
+    global start_left
+    # one worker per strip, reading the frame banks from shared memory
+    frame_banks = get_frame_banks(lightpaints, led_buffers)
+    pool = StripWorkerPool(strips, frame_banks, worker_cores)
+    pool.start()
+    print('Started ' + str(n_strips) + ' strip workers on cores ' + str(worker_cores))
+    prime_pool(pool, display_durs, image_set_names[display_these_img])
+    try:
+        iteration_nr = 0
+        not_pressed_ESC = True
+        while not_pressed_ESC:
+            # the central timeline releases every strip at its onset
+            if start_left == 1: # left-to-right presentation
+                order = list(range(n_strips))
+            else: # right-to-left presentation
+                order = list(range(n_strips-1, -1, -1))
+            # sweep deadlines corrected for the overshoot (the onsets still follow display_durs)
+            sweep_durs = None
+            if duration_controller is not None:
+                sweep_durs = [compensated_durs(k, display_durs[k]/1000.0, 0)[0]*1000 for k in range(n_strips)]
+            if clock_sync is not None: # start the cycle at the agreed time
+                sync_cycle, sync_onset = clock_sync.next_cycle(min_lead=0.005)
+                pres_durs, n_shows, inter_frame_time, onset_errors = pool.run_cycle(display_durs, inter_durs, order,
+                    cycle_start=sync_onset, reverse=reverse_columns(start_left), sweep_durs=sweep_durs)
+                clock_sync.report_onset(sync_cycle, pool.last_onsets[0])
+            else:
+                pres_durs, n_shows, inter_frame_time, onset_errors = pool.run_cycle(display_durs, inter_durs, order,
+                    reverse=reverse_columns(start_left), sweep_durs=sweep_durs)
+            for j in range(n_strips):
+                if duration_controller is not None:
+                    duration_controller.update(order[j], display_durs[order[j]]/1000.0, pres_durs[j]/1000.0)
+                log_presentation(logger, iteration_nr, display_these_img, order[j], display_durs, inter_durs, brightness_config,
+                    pres_durs[j], n_shows[j], pool.last_onsets[j])
+            iteration_nr += 1
+            # show some feedback
+            print('Iter=' + str(iteration_nr) + ' Presentation duration: ' + str(pres_durs))
+            print('Iter=' + str(iteration_nr) + ' Number of "shows":     ' + str(n_shows))
+            print('Iter=' + str(iteration_nr) + ' Time between "shows":  ' + str(inter_frame_time))
+            print('Iter=' + str(iteration_nr) + ' Onset error [ms]:      ' + str(onset_errors))
+            print_duration_errors(iteration_nr)
+            print(' ')
+            # check keyboard and update config, if necessary
+            old_lightpaints = lightpaints
+            display_durs, inter_durs, brightness_config, not_pressed_ESC, display_these_img, lightpaints, img_widths = checkKeyboard(
+                display_durs, inter_durs, brightness_config, not_pressed_ESC, display_these_img, lightpaints, img_widths)
+            # new stimuli? restart the workers with new frame banks
+            if lightpaints is not old_lightpaints:
+                pool.stop()
+                frame_banks = get_frame_banks(lightpaints, led_buffers)
+                pool = StripWorkerPool(strips, frame_banks, worker_cores)
+                pool.start()
+                prime_pool(pool, display_durs, image_set_names[display_these_img])
+            # update left-to-right -> right-to-left and reverse
+            if presentation_alternating == 1:
+                start_left = 1 - start_left
+            # pick up images ingested from USB
+            add_ingested_sets()
+            # new durations or images? check that all columns can be shown (by the workers)
+            replan(display_durs, img_widths, frame_banks)
+            # system sleep to prepare for presentation once more
+            if clock_sync is not None: # the next agreed onset replaces fix_time
+                if realtime_mode == 1:
+                    collect_in_gap(0) # garbage is only collected here
+            elif realtime_mode == 1:
+                collect_in_gap(fix_time/1000.0) # garbage is only collected here
+            else:
+                time.sleep(fix_time/1000.0)
+    except KeyboardInterrupt:
+        print('Exiting...')
+    finally: # also if a worker failed
+        pool.stop()
+
+
+
 ## read new values
 if __name__ == '__main__':
     
     ## Create and initialize strips
     # check consistency of inputs
-    display_these_img = images_default
+    load_stimulus_catalog()
+    display_these_img = stimulus_catalog.index_of(images_default)
     assert(len(images[display_these_img])==len(display_durs))
     assert(len(display_durs)==len(inter_durs))
     assert(len(display_durs)==n_strips)
@@ -445,11 +835,88 @@ if __name__ == '__main__':
     # create lightpaint object, load image that we've specified
     lightpaints, img_widths = get_lightpaint(images[display_these_img], strips, n_leds, brightness_config)
 
+    # sets that LightPaint will dim to stay within the peak current
+    stimulus_catalog.check_current(power_settings[1])
+
+    # send only the changing part of frame-bank columns
+    frame_bank.delta_writes = (delta_writes == 1)
+
     # okay!
     print('Done preparing!')
+
+    # hot-load new stimuli from USB sticks in the background
+    if usb_ingest == 1:
+        usb_ingester = UsbIngest(usb_mount_root, ingest_path, n_leds[0])
+        usb_ingester.start()
+    else: # 99_lightpaint_mount signals every interface, the default action would end this one
+        signal.signal(signal.SIGUSR1, signal.SIG_IGN)
+        signal.signal(signal.SIGUSR2, signal.SIG_IGN)
+
+    # real-time mode: protect sweeps from the scheduler, page faults and the garbage collector
+    if jitter_benchmark_sweeps > 0:
+        benchmark_jitter(lambda: run_paint(display_durs[0]/1000.0, inter_durs[0]/1000.0, lightpaints[0], led_buffers[0], strips[0]),
+            jitter_benchmark_sweeps, realtime_priority, led_buffers)
+        if realtime_mode == 0:
+            leave_realtime()
+    elif realtime_mode == 1:
+        enter_realtime(realtime_priority, led_buffers)
     
 
+    # warm caches, clock and buffers before the calibrations and the first real sweep
+    if parallel_strips != 1: # strip workers are primed when they are started
+        prime_sweeps(strips, led_buffers, [(k, lightpaints[k], display_durs[k]) for k in range(n_strips)],
+            image_set_names[display_these_img])
+
+    # per-presentation session log
+    logger = start_session_log()
+
+    # plan and calibrate with what will be shown (strip workers show frame banks, without dither)
+    if parallel_strips == 1:
+        calibration_stimuli = get_frame_banks(lightpaints, led_buffers)
+    else:
+        calibration_stimuli = lightpaints
+
+    # predict shows per sweep from calibrated show costs
+    if plan_throughput == 1:
+        strip_costs = [calibrate_strip(strips[i], n_leds[i], is_hardware_spi(pin_config[i]), calibration_stimuli[i])
+            for i in range(n_strips)]
+        print_plan(strip_costs, display_durs, images, [[stimulus_width(name) for name in image_set] for image_set in images])
+        replan(display_durs, img_widths, calibration_stimuli)
+
+    # calibrate the sweep overshoot
+    start_duration_control(strips, led_buffers, [(k, calibration_stimuli[k], display_durs[k]) for k in range(n_strips)])
+
+    # onset/offset events for eye-tracker and photodiode alignment
+    strips = start_sync_events(strips)
+
+    # synchronize cycle onsets with other devices
+    if sync_role:
+        clock_sync = ClockSync(sync_role, sync_master_host, sync_port, sync_period/1000.0,
+            onset_log=(sync_onset_log or None))
+        clock_sync.start()
+        print('Clock sync: ' + sync_role + ', offset to master = ' + str(round(clock_sync.offset*1000, 3)) + ' ms')
+
+    # hot-path phase histograms, served on a local port
+    if profile_phases == 1:
+        phase_profiler = PhaseProfiler(n_strips)
+        serve_metrics(phase_profiler, metrics_port)
+        print('Phase histograms at http://127.0.0.1:' + str(metrics_port) + '/metrics')
+        if parallel_strips == 1:
+            print('Warning! The phase profiler only times serial LightPaint sweeps: strip workers are not profiled, /metrics stays empty')
+
     ## Display and timing loop
+    if parallel_strips == 1: # one worker process per strip
+        try:
+            run_parallel_paint(display_durs, inter_durs, brightness_config, display_these_img, lightpaints, img_widths, logger)
+        finally: # the strips are dark on any exit, also if a worker failed
+            if logger is not None:
+                logger.close()
+            for i in range(n_strips):
+                strips[i].clear()
+                strips[i].show()
+            if sync_events is not None:
+                sync_events.close()
+        sys.exit()
     try:
         iteration_nr = 0
         # setup loop
@@ -457,20 +924,28 @@ if __name__ == '__main__':
         pres_durs = []        # what's the real presentation time?
         n_shows = []          # how many shows per strip?
         inter_frame_time = [] # what's the mean time between 'shows'
+        show_intervals = []   # all times between 'shows' of this iteration (for jitter)
         not_pressed_ESC = True
+        if clock_sync is not None: # wait for the first agreed cycle onset
+            sync_cycle, sync_onset = clock_sync.wait_next_cycle()
         # run the presentation until we press a valid key
         while not_pressed_ESC:
             # run the presentation function
             if start_left == 1: # left-to-right presentation
-                frame_times = run_paint(display_durs[i]/1000.0, inter_durs[i]/1000.0, 
-                    lightpaints[i], led_buffers[i], strips[i])
+                k = i
             else: # right-to-left presentation
-                frame_times = run_paint(display_durs[(n_strips-1)-i]/1000.0, inter_durs[(n_strips-1)-i]/1000.0, 
-                    lightpaints[(n_strips-1)-i], led_buffers[(n_strips-1)-i], strips[(n_strips-1)-i])
+                k = (n_strips-1)-i
+            onset = monotonic()
+            frame_times = run_paint_strip(k, display_durs, inter_durs, lightpaints, reverse_columns(start_left))
+            if clock_sync is not None and i == 0:
+                clock_sync.report_onset(sync_cycle, onset)
             # save the timing info
             pres_durs.append(round(frame_times[-1]*1000,2))
             n_shows.append(len(frame_times)-1)
             inter_frame_time.append(round(np.mean(np.diff(frame_times[0:len(frame_times)-1]))*1000, 2))
+            show_intervals.extend(inter_show_intervals(frame_times))
+            log_presentation(logger, iteration_nr, display_these_img, k,
+                display_durs, inter_durs, brightness_config, frame_times[-1]*1000, len(frame_times)-1, onset)
             # check keyboard and update config, if necessary
             display_durs, inter_durs, brightness_config, not_pressed_ESC, display_these_img, lightpaints, img_widths = checkKeyboard(
                 display_durs, inter_durs, brightness_config, not_pressed_ESC, display_these_img, lightpaints, img_widths)
@@ -482,33 +957,55 @@ if __name__ == '__main__':
                 print('Iter=' + str(iteration_nr) + ' Presentation duration: ' + str(pres_durs))
                 print('Iter=' + str(iteration_nr) + ' Number of "shows":     ' + str(n_shows))
                 print('Iter=' + str(iteration_nr) + ' Time between "shows":  ' + str(inter_frame_time))
+                print('Iter=' + str(iteration_nr) + ' Jitter p50/p90/p99/max: ' + str(get_jitter(show_intervals)))
+                print_duration_errors(iteration_nr)
                 print(' ')
                 # reset
                 i = 0
                 pres_durs = []        # what's the real presentation time?
                 n_shows = []          # how many shows per strip?
                 inter_frame_time = [] # what's the mean time between 'shows'
+                show_intervals = []
                 # update left-to-right -> right-to-left and reverse
                 if presentation_alternating == 1:
                     if start_left == 1:
                         start_left = 0
                     else:
                         start_left = 1
+                # pick up images ingested from USB
+                add_ingested_sets()
+                # new durations or images? check that all columns can be shown
+                replan(display_durs, img_widths, lightpaints)
                 # system sleep to prepare for presentation once more
-                time.sleep(fix_time/1000.0)
+                if clock_sync is not None: # next cycle starts at the agreed time
+                    if realtime_mode == 1:
+                        collect_in_gap(0) # garbage is only collected here
+                    sync_cycle, sync_onset = clock_sync.wait_next_cycle()
+                elif realtime_mode == 1:
+                    collect_in_gap(fix_time/1000.0) # garbage is only collected here
+                else:
+                    time.sleep(fix_time/1000.0)
             
     except KeyboardInterrupt:
         # all done.
         print('Exiting...')
+        if logger is not None:
+            logger.close()
         for i in range(n_strips):
             strips[i].clear()
             strips[i].show()
+        if sync_events is not None:
+            sync_events.close()
         sys.exit()
         
     ## Shutdown and save
+    if logger is not None:
+        logger.close()
     for i in range(n_strips):
         strips[i].clear()
         strips[i].show()
+    if sync_events is not None:
+        sync_events.close()
     sys.exit()
 
 
@@ -40,6 +40,10 @@ from lightpaint import LightPaint
 from PIL import Image
 import npyscreen # sudo pip install npyscreen
 import keyboard  # sudo pip install keyboard
+from stimulus_registry import StimulusRegistry
+from stimulus_catalog import StimulusCatalog
+from usb_ingest import UsbIngest
+from monotonic_clock import monotonic
 
 
 
@@ -50,31 +54,8 @@ n_strips = 1 ## this interface is only for one LED strip!
 pin_config = [[17, 27]] # [[16, 26], [17, 27], [5, 6], [23, 24]]
 n_leds = [144]
 n_presentations_per_strip = 1 # given that we use one strip, how many presentations per strip would we like?
-# images for 4 presentations
-images = [["TestColourOrder.jpg", "TestColourOrder.jpg", "TestColourOrder.jpg", "TestColourOrder.jpg"], # 0
-    ["CAN.png", "YOU.png", "SEE.png", "THIS.png"],     # 1
-    ["ENJOY.png", "YOUR.png", "BEER.png", "MATE.png"],  # 2
-    ["HER.png", "LOVE.png", "IS.png", "REAL.png"],      # 3
-    ["GUCK.png", "MAL.png", "HIER.png", "HER.png"],      # 4
-    ["KEIN.png", "BIER.png", "FUER.png", "NAZIS.png"],    # 5
-    ["DEIN.png", "AUGE.png", "LUEGT.png", "NICHT.png"],     # 6
-    ["DIE.png", "NACHT.png", "IST.png", "JUNG.png"],     # 7
-    ["cactus.jpg", "usa.jpg", "30.jpg", "Donald-Trump.jpg"],  # 8: picture stimuli
-    ["marge.jpg", "lisa.jpg", "bart.jpg", "homer.jpg"]]        # 9: picture stimuli
-# images for 1 presentation
-images = [["TestColourOrder.jpg"], # 0
-    ["BIER.png"],     # 1
-    ["ENJOY.png"],  # 2
-    ["LOVE.png"],      # 3
-    ["GUCK.png"],      # 4
-    ["REAL.png"],    # 5
-    ["AUGE.png"],     # 6
-    ["30.jpg"],     # 7
-    ["usa.jpg"],  # 8: picture stimuli
-    ["homer.jpg"]]        # 9: picture stimuli
-
-images_default = 0 #  "Check that each LED shows all three colours, Green, Red, Blue"
-n_images = len(images)
+sets_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'stimulus_sets_onestrip.json') # named image sets, one file per presentation
+images_default = 'colour-test' #  "Check that each LED shows all three colours, Green, Red, Blue"
 
 # standard/start values
 brightness_config = [255]
@@ -96,9 +77,36 @@ max_dur_slider = 100            # slider maximum presentation duration
 max_brightness_slider = 255     # slider maximum brightness
 WaitForKey_time = 0.1      # in seconds, how much time for detecting a key?
 increase_duration_step = 1  # in milliseconds
+stimulus_keys = [] # registry keys of the stimuli that are currently loaded
+usb_ingest = 0 # 1: hot-load images from USB sticks (SIGUSR1 from 99_lightpaint_mount)
+usb_mount_root = '/media' # where usbmount mounts sticks
+ingest_path = '/home/pi/PersistenceOfVision/pv/NEW PV/stimuli-usb' # local copies of ingested images
+usb_ingester = None # background ingest, started in main
+ingested_files = [] # ingested images that do not fill a complete image set yet
+
+
+## Stimulus catalog
+# index of all stimuli in image_path and the image sets of sets_file (see stimulus_catalog.py),
+# built by load_stimulus_catalog() before anything is shown
+stimulus_catalog = StimulusCatalog(image_path, sets_file, n_leds[0], gamma, color_balance_factors)
+stimulus_registry = StimulusRegistry(image_path, stimulus_catalog) # processed stimuli, shared by strips, sets and presentations
+image_set_names = [] # in the order of the keys 0-9 and the slider
+images = [] # file names of every image set
+n_images = 0
 
 
 ## Aux functions
+
+# Build the stimulus catalog and the image sets from it (sets with missing
+# files are listed, but only refused when they are selected)
+def load_stimulus_catalog():
+    global n_images
+    stimulus_catalog.build(n_presentations_per_strip)
+    image_set_names[:] = stimulus_catalog.set_names()
+    images[:] = [stimulus_catalog.sets[name] for name in image_set_names]
+    n_images = len(images)
+
+
 # Load image, do some conversion and processing as needed before painting.
 def loadImage(filename, strip, npixels, brightness, 
         gamma, color_balance_factors, power_settings, color_order, vflip):
@@ -151,20 +159,20 @@ def loadImage(filename, strip, npixels, brightness,
 def run_paint(dur, delay, lightpaint_name, ledBuffer, which_strip):
         elapsed = 0 # time elapsed since startTime
         frame_times = [] # here we'll list the timestamps
-        startTime = time.clock() # time at start of the presentation 
+        startTime = monotonic() # time at start of the presentation 
         # interpolate through the frames
         if dur > 0:
             while elapsed <= dur:
-                elapsed   = time.clock() - startTime
+                elapsed   = monotonic() - startTime
                 lightpaint_name.dither(ledBuffer, elapsed / dur) # interpolate the column of the image write to buffer
                 which_strip.show(ledBuffer) # display the buffer
-                frame_times.append(time.clock() - startTime) # save the timestamp after the 'show' command
+                frame_times.append(monotonic() - startTime) # save the timestamp after the 'show' command
         else:
             print 'Warning! Duration is zero'
         # remove the display from the strip here
         which_strip.clear()
         which_strip.show()
-        break_time = time.clock()
+        break_time = monotonic()
         frame_times.append(break_time-startTime) # last timestamp of presentation
         # wait for delay time (no need to timestamp this)
         sleep_for_time = delay+dur-(break_time-startTime)
@@ -229,18 +237,46 @@ def get_lightpaint(images_here, strips_here, n_leds_here, brightness_config_here
     assert(n_strips_here==len(images_here))
     assert(n_strips_here==len(n_leds_here))
     assert(n_strips_here==len(brightness_config_here))
-    # make lightpaint objects
+    # make lightpaint objects (each unique stimulus is only processed once)
     for i in range(n_strips_here):
-        # 
-        lightpaint, img_width = loadImage(images_here[i], strips_here[i], n_leds_here[i], brightness_config_here[i], 
-            gamma, color_balance_factors, power_settings, color_order, vflip)
+        params = (n_leds_here[i], brightness_config_here[i], gamma, color_balance_factors, power_settings, color_order, vflip)
+        lightpaint, img_width, key = stimulus_registry.acquire(images_here[i], params,
+            lambda: loadImage(images_here[i], strips_here[i], n_leds_here[i], brightness_config_here[i],
+                gamma, color_balance_factors, power_settings, color_order, vflip))
         # add to list
         lightpaints_here.append(lightpaint)
         img_widths_here.append(img_width)
+        stimulus_keys.append(key)
         print('--> Loaded image of strip ' + str(i+1) + ': ' + images_here[i] + ' (brightness=' + str(brightness_config_here) + ')')
     return lightpaints_here, img_widths_here
 
 
+# Start loading a new set of stimuli: returns the registry keys of the old set,
+# which should be released once the new set is loaded (so shared stimuli stay)
+def begin_stimulus_switch():
+    global stimulus_keys
+    old_keys = stimulus_keys
+    stimulus_keys = []
+    return old_keys
+
+
+# Append images ingested from USB as new image sets (called between iterations)
+def add_ingested_sets():
+    global n_images
+    if usb_ingester is None:
+        return
+    for filename in usb_ingester.poll():
+        if not filename in ingested_files and not any(filename in image_set for image_set in images):
+            ingested_files.append(filename)
+    while len(ingested_files) >= n_presentations_per_strip:
+        images.append(ingested_files[0:n_presentations_per_strip])
+        del ingested_files[0:n_presentations_per_strip]
+        n_images = len(images)
+        image_set_names.append('usb-' + str(n_images-1))
+        stimulus_catalog.add_set(image_set_names[-1], images[-1])
+        print('Added image set ' + str(n_images-1) + ' from USB: ' + str(images[-1]))
+
+
 
 
 ## make form
@@ -251,7 +287,7 @@ class myPVoptions(npyscreen.Form):
         # which test pattern to start?
         self.testPattern = self.add(npyscreen.TitleSlider, lowest = 0, out_of=n_images-1, 
             value = display_these_img,
-            name = "Test pattern [0..9]")
+            name = "Test pattern [0.." + str(n_images-1) + "]")
         # presentation style
 #        self.pres_style = self.add(npyscreen.TitleMultiSelect, max_height=-2, value = [1,], name="Pres style",
 #            values = ["OneDirection", "Alternating"], scroll_exit=True)
@@ -298,6 +334,7 @@ def myPVinterface(*args):
 def checkKeyboard(display_durs, inter_durs, brightness_config, not_pressed_ESC, display_these_img, lightpaints, img_widths):
     # will be set to True if lightpaint shall be switched
     switch_lightpaint = False 
+    shown_img = display_these_img # image set shown so far
     
     # check keyboard here
     try:  # used try so that if user pressed other than the given key error will not be shown
@@ -374,20 +411,41 @@ def checkKeyboard(display_durs, inter_durs, brightness_config, not_pressed_ESC,
         elif keyboard.is_pressed('9'): 
             display_these_img = 9
             switch_lightpaint = True
+        # next / previous image set (also beyond 9)
+        elif keyboard.is_pressed('right'):
+            display_these_img = (display_these_img + 1) % n_images
+            switch_lightpaint = True
+        elif keyboard.is_pressed('left'):
+            display_these_img = (display_these_img - 1) % n_images
+            switch_lightpaint = True
         # do nothing if no key was pressed
         else:
             pass
     except:
         pass  # if user pressed a key other than the given key the loop will not break
     
+    # image sets with missing files (and digits without a set) are not shown
+    if switch_lightpaint == True:
+        try:
+            if display_these_img >= n_images:
+                raise ValueError('There is no image set ' + str(display_these_img) + ' (' + str(n_images) + ' sets)')
+            stimulus_catalog.index_of(image_set_names[display_these_img])
+        except ValueError as e:
+            print(str(e))
+            display_these_img = shown_img
+            switch_lightpaint = False
+
     # if necessary, load new test patterns!
     if switch_lightpaint == True:
+        old_keys = begin_stimulus_switch()
         lightpaints = []
         for i in range(n_presentations_per_strip):
             display_now = list([images[display_these_img][i]])
             lightpaint_now, img_widths = get_lightpaint(display_now, strips, n_leds, brightness_config)
             lightpaints.append(lightpaint_now[0])
-        print('Created lightpaint of: ' + str(images[display_these_img]) + ', Length=' + str(len(lightpaints)))
+        stimulus_registry.release_all(old_keys)
+        print('Created lightpaint of: ' + image_set_names[display_these_img] + ' ' + str(images[display_these_img]) +
+            ', Length=' + str(len(lightpaints)))
     
     # return here
     return display_durs, inter_durs, brightness_config, not_pressed_ESC, display_these_img, lightpaints, img_widths
@@ -399,7 +457,9 @@ if __name__ == '__main__':
     
     ## Create and initialize strips
     # check consistency of inputs
-    display_these_img = images_default
+    load_stimulus_catalog()
+    display_these_img = stimulus_catalog.index_of(images_default)
+    stimulus_catalog.check_current(power_settings[1]) # sets that LightPaint will dim
 
     # set up strip list
     strips = initialize_strips(n_leds, pin_config)
@@ -421,6 +481,14 @@ if __name__ == '__main__':
 
     # okay!
     print('Done preparing!')
+
+    # hot-load new stimuli from USB sticks in the background
+    if usb_ingest == 1:
+        usb_ingester = UsbIngest(usb_mount_root, ingest_path, n_leds[0])
+        usb_ingester.start()
+    else: # 99_lightpaint_mount signals every interface, the default action would end this one
+        signal.signal(signal.SIGUSR1, signal.SIG_IGN)
+        signal.signal(signal.SIGUSR2, signal.SIG_IGN)
     
 
     ## Display and timing loop
@@ -468,6 +536,8 @@ if __name__ == '__main__':
                         start_left = 0
                     else:
                         start_left = 1
+                # pick up images ingested from USB
+                add_ingested_sets()
                 # system sleep to prepare for presentation once more
                 time.sleep(fix_time/1000.0)
             
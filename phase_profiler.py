@@ -0,0 +1,182 @@
+#!/usr/bin/python
+
+# --------------------------------------------------------------------------
+# Low-overhead phase profiler for the sweep hot path.
+#
+# The per-iteration feedback only shows averages per strip. The profiler
+# times every phase of a sweep separately:
+#   dither     LightPaint.dither(), i.e. preparing the column (CPU), and
+#              finding its extent for delta writes (see frame_bank.py)
+#   show       strip.show(), i.e. the transfer (hardware SPI or bit-bang)
+#   timestamp  taking and storing the timestamp after the show
+#   clear      clearing the strip at the end of the presentation
+#   gap        waiting for the inter-strip gap
+# Timings go into fixed-bucket histograms in one preallocated flat array, so
+# recording a sample is a bisect and three additions. The histograms can be
+# read through a small HTTP endpoint (text format, /metrics and /summary),
+# and printed with:
+#
+#   python phase_profiler.py [http://127.0.0.1:9100]
+#
+# This tells whether a slow strip is CPU-bound (dither) or transfer-bound
+# (show). Only serial sweeps of LightPaint objects are profiled: frame banks
+# (procedural stimuli, strip workers) and streamed images are not, and the
+# interface says so when it shows them.
+# --------------------------------------------------------------------------
+
+import sys
+import time
+import array
+import bisect
+import numpy as np
+import frame_bank
+from frame_bank import delta_column
+from monotonic_clock import monotonic
+from realtime_mode import background_thread
+try:
+    from http.server import HTTPServer, BaseHTTPRequestHandler # Python 3
+    from urllib.request import urlopen
+except ImportError:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler # Python 2
+    from urllib2 import urlopen
+
+PHASES = ('dither', 'show', 'timestamp', 'clear', 'gap')
+DITHER, SHOW, TIMESTAMP, CLEAR, GAP = range(len(PHASES))
+# upper bucket edges in seconds; the last bucket takes everything above
+BUCKET_EDGES = (1e-6, 2e-6, 5e-6, 1e-5, 2e-5, 5e-5, 1e-4, 2e-4, 5e-4,
+    1e-3, 2e-3, 5e-3, 1e-2, 2e-2, 5e-2, 1e-1)
+
+
+class PhaseProfiler(object):
+    def __init__(self, n_strips):
+        self.n_strips = n_strips
+        self.n_buckets = len(BUCKET_EDGES) + 1
+        size = n_strips * len(PHASES)
+        self.counts = array.array('l', [0] * (size * self.n_buckets))
+        self.sums = array.array('d', [0.0] * size)
+        self.maxes = array.array('d', [0.0] * size)
+
+    def record(self, strip, phase, seconds):
+        i = strip * len(PHASES) + phase
+        self.counts[i * self.n_buckets + bisect.bisect_left(BUCKET_EDGES, seconds)] += 1
+        self.sums[i] += seconds
+        if seconds > self.maxes[i]:
+            self.maxes[i] = seconds
+
+    def histogram(self, strip, phase):
+        i = (strip * len(PHASES) + phase) * self.n_buckets
+        return list(self.counts[i:i + self.n_buckets])
+
+    # Text exposition of all histograms (Prometheus style)
+    def metrics_text(self):
+        lines = []
+        for strip in range(self.n_strips):
+            for phase in range(len(PHASES)):
+                labels = 'strip="' + str(strip+1) + '",phase="' + PHASES[phase] + '"'
+                counts = self.histogram(strip, phase)
+                cumulative = 0
+                for b in range(self.n_buckets):
+                    cumulative += counts[b]
+                    le = repr(BUCKET_EDGES[b]) if b < len(BUCKET_EDGES) else '+Inf'
+                    lines.append('pv_phase_seconds_bucket{' + labels + ',le="' + le + '"} ' + str(cumulative))
+                i = strip * len(PHASES) + phase
+                lines.append('pv_phase_seconds_sum{' + labels + '} ' + repr(self.sums[i]))
+                lines.append('pv_phase_seconds_count{' + labels + '} ' + str(cumulative))
+                lines.append('pv_phase_seconds_max{' + labels + '} ' + repr(self.maxes[i]))
+        return '\n'.join(lines) + '\n'
+
+    # Human-readable table: count, mean, p50, p99 (bucket upper edges), max
+    def summary_text(self):
+        lines = ['strip  phase       count     mean[us]   p50[us]   p99[us]   max[us]']
+        for strip in range(self.n_strips):
+            for phase in range(len(PHASES)):
+                i = strip * len(PHASES) + phase
+                counts = self.histogram(strip, phase)
+                n = sum(counts)
+                if n == 0:
+                    continue
+                lines.append('%5d  %-9s %7d %12.1f %9s %9s %9.1f' % (strip+1, PHASES[phase], n,
+                    self.sums[i] / n * 1e6, _percentile(counts, n, 0.5), _percentile(counts, n, 0.99),
+                    self.maxes[i] * 1e6))
+        return '\n'.join(lines) + '\n'
+
+
+def _percentile(counts, n, p):
+    cumulative = 0
+    for b in range(len(counts)):
+        cumulative += counts[b]
+        if cumulative >= p * n:
+            return ('<=%.0f' % (BUCKET_EDGES[b] * 1e6)) if b < len(BUCKET_EDGES) else '>%.0f' % (BUCKET_EDGES[-1] * 1e6)
+    return '-'
+
+
+# Same as run_paint, but every phase is timed into the profiler
+def run_paint_profiled(dur, delay, lightpaint_name, ledBuffer, which_strip, profiler, k, reverse=False):
+    elapsed = 0 # time elapsed since startTime
+    frame_times = [] # here we'll list the timestamps
+    leds = np.frombuffer(ledBuffer, dtype=np.uint8) if frame_bank.delta_writes else None
+    lit = 0 # LEDs up to the last lit one on the strip (dark after clear)
+    record = profiler.record
+    startTime = monotonic() # time at start of the presentation
+    if dur > 0:
+        while elapsed <= dur:
+            t0 = monotonic()
+            elapsed = t0 - startTime
+            lightpaint_name.dither(ledBuffer, max(0.0, 1.0 - elapsed / dur) if reverse else elapsed / dur) # interpolate the column of the image write to buffer
+            if leds is not None:
+                column, lit = delta_column(leds, lit)
+            t1 = monotonic()
+            which_strip.show(ledBuffer if leds is None else column) # display the buffer (up to the last LED that changes)
+            t2 = monotonic()
+            frame_times.append(t2 - startTime) # save the timestamp after the 'show' command
+            t3 = monotonic()
+            record(k, DITHER, t1 - t0)
+            record(k, SHOW, t2 - t1)
+            record(k, TIMESTAMP, t3 - t2)
+    else:
+        print('Warning! Duration is zero')
+    # remove the display from the strip here
+    t0 = monotonic()
+    which_strip.clear()
+    which_strip.show()
+    break_time = monotonic()
+    record(k, CLEAR, break_time - t0)
+    frame_times.append(break_time - startTime) # last timestamp of presentation
+    # wait for delay time
+    sleep_for_time = delay + dur - (break_time - startTime)
+    if sleep_for_time > 0:
+        time.sleep(sleep_for_time)
+    record(k, GAP, monotonic() - break_time)
+    return frame_times
+
+
+# Serve /metrics and /summary on a local port from a background thread
+def serve_metrics(profiler, port, host='127.0.0.1'):
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.startswith('/metrics'):
+                body = profiler.metrics_text()
+            elif self.path.startswith('/summary') or self.path == '/':
+                body = profiler.summary_text()
+            else:
+                self.send_error(404)
+                return
+            body = body.encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass # no console output from the server
+
+    server = HTTPServer((host, port), MetricsHandler)
+    thread = background_thread(server.serve_forever)
+    thread.start()
+    return server
+
+
+if __name__ == '__main__':
+    url = sys.argv[1] if len(sys.argv) > 1 else 'http://127.0.0.1:9100'
+    sys.stdout.write(urlopen(url.rstrip('/') + '/summary').read().decode('utf-8'))
@@ -0,0 +1,87 @@
+#!/usr/bin/python
+
+# --------------------------------------------------------------------------
+# Priming: dark sweeps of newly loaded stimuli before the first real one.
+#
+# The first sweeps after loading an image set are slower than the rest:
+# CPU caches are cold, the frequency governor has not ramped up yet, new
+# buffers are touched for the first time (page faults) and dotstar.c
+# allocates its scaling buffer (pBuf) on the first show. Priming runs the
+# real sweep code (dither, frame-bank indexing, show, clear) against every
+# loaded stimulus, but through a DarkStrip: every column is read and sent
+# with the same number of bytes, with all color bytes zeroed, so the strip
+# stays dark. Rounds of sweeps are repeated until the cost per show of every
+# sweep has settled:
+#   the median of the last 'window' costs differs from the median of the
+#   'window' costs before by at most 'tolerance' (fraction)
+# Medians ignore single slow rounds (scheduling, other threads). Priming
+# stops after max_time seconds in any case, with a warning.
+# --------------------------------------------------------------------------
+
+import numpy as np
+from monotonic_clock import monotonic
+from sync_events import bare_strip
+
+
+class DarkStrip(object):
+    def __init__(self, strip):
+        self._strip = bare_strip(strip) # no sync events for dark sweeps
+        self._scratch = {} # length -> buffer that is sent instead of the column
+
+    # setPixelColor, clear, ... go straight to the strip
+    def __getattr__(self, name):
+        return getattr(self._strip, name)
+
+    def show(self, *args):
+        if not args: # clear or loading colors: already dark
+            self._strip.show()
+            return
+        data = args[0] if isinstance(args[0], np.ndarray) else np.frombuffer(args[0], dtype=np.uint8)
+        scratch = self._scratch.get(data.size)
+        if scratch is None:
+            scratch = self._scratch[data.size] = np.empty(data.size, dtype=np.uint8)
+        scratch[:] = data # read the column, like the strip would
+        scratch.reshape(-1, 4)[:, 1:] = 0 # keep the 0xFF headers, zero B/G/R
+        self._strip.show(scratch)
+
+
+# Cost per show of one sweep [s] (mean time between shows, without clear)
+def show_cost(frame_times):
+    if len(frame_times) < 3:
+        return frame_times[-1]
+    return (frame_times[-2] - frame_times[0]) / (len(frame_times) - 2)
+
+
+def _median(values):
+    return sorted(values)[len(values) // 2]
+
+
+# Median cost of sweep s over some rounds
+def _median_cost(rounds, s):
+    return _median([costs[s] for costs in rounds])
+
+
+# Repeat run_round() until the costs it returns (one per sweep, [s]) have
+# settled, or for at most max_time [s]. Returns the number of rounds, the
+# time taken [s], whether the costs settled, and the costs of the first
+# round and the settled costs (median of the last window).
+def prime(run_round, tolerance=0.02, window=3, max_time=1.5):
+    costs = []
+    startTime = monotonic()
+    settled = False
+    while not settled and (not costs or monotonic() - startTime < max_time):
+        costs.append(run_round())
+        if len(costs) >= 2 * window:
+            last, before = costs[-window:], costs[-2*window:-window]
+            settled = all(abs(_median_cost(last, s) - _median_cost(before, s)) <= tolerance * _median_cost(before, s)
+                for s in range(len(costs[0])))
+    last = costs[-window:]
+    return len(costs), monotonic() - startTime, settled, costs[0], [_median_cost(last, s) for s in range(len(costs[0]))]
+
+
+# One line per priming: rounds, time and cost per show [us] (first -> settled)
+def print_priming(label, result):
+    n_rounds, elapsed, settled, first, final = result
+    print(('Primed ' if settled else 'Warning! Priming stopped at the time limit, not settled: ') + label + ': ' + str(n_rounds) +
+        ' rounds, ' + str(round(elapsed*1000, 1)) + ' ms, cost per show [us]: ' +
+        str([int(round(c*1e6)) for c in first]) + ' -> ' + str([int(round(c*1e6)) for c in final]))
@@ -0,0 +1,136 @@
+#!/usr/bin/python
+
+# --------------------------------------------------------------------------
+# Procedural stimuli (gratings, noise, bars) generated straight into frame
+# banks, i.e. the strip-ready column format of frame_bank.py, at the strip's
+# LED count and color order. No image files and no LightPaint involved.
+#
+# Stimuli are given as specs that can be used in place of a file name in the
+# 'images' table or in a trial list:
+#   gen:grating?cycles=4&phase=0.25&contrast=1&wave=sine&orientation=vertical
+#   gen:noise?seed=3&density=0.5&chromatic=0
+#   gen:bars?columns=10,30&bar_width=2
+# Common parameters: width (columns, default 45), color (r,g,b; 0..255).
+# 'vertical' gratings vary across columns (along the sweep), 'horizontal'
+# ones along the strip. Noise without a seed is fresh on every call and is not
+# cached; everything else is cached by its parameters.
+#
+# Like LightPaint, the generator applies gamma correction, the color balance
+# (brightness) and vflip; it does not do power limiting. With n_phases > 1,
+# every column gets n_phases frames that are temporally dithered around the
+# (floating point) gamma-corrected target, see frame_bank.py.
+# --------------------------------------------------------------------------
+
+import collections
+import numpy as np
+from frame_bank import indexed_bank
+
+SPEC_PREFIX = 'gen:'
+max_cached = 256 # frame banks kept in the cache
+_cache = collections.OrderedDict()
+_fresh_rng = np.random.RandomState() # for noise without a seed (seeded once from the OS)
+
+
+def is_procedural(name):
+    return name.startswith(SPEC_PREFIX)
+
+
+# 'gen:kind?a=1&b=2,3' -> ('kind', {'a': 1.0, 'b': (2.0, 3.0)})
+def parse_spec(spec):
+    body = spec[len(SPEC_PREFIX):]
+    kind, _, query = body.partition('?')
+    params = {}
+    for item in query.split('&'):
+        if not item:
+            continue
+        name, _, value = item.partition('=')
+        if name in ('wave', 'orientation'):
+            params[name] = value
+        elif ',' in value:
+            params[name] = tuple(float(v) for v in value.split(','))
+        else:
+            params[name] = float(value)
+    return kind, params
+
+
+def grating(width, n_leds, cycles=4.0, phase=0.0, contrast=1.0, wave='sine', orientation='vertical'):
+    if orientation == 'vertical': # varies across columns
+        x = (np.arange(width) + 0.5) / width
+    else: # varies along the strip
+        x = (np.arange(n_leds) + 0.5) / n_leds
+    carrier = np.sin(2 * np.pi * (cycles * x + phase))
+    if wave == 'square':
+        carrier = np.sign(carrier)
+    profile = 0.5 + 0.5 * contrast * carrier
+    if orientation == 'vertical':
+        return np.repeat(profile[:, np.newaxis], n_leds, axis=1)
+    return np.repeat(profile[np.newaxis, :], width, axis=0)
+
+
+def noise(width, n_leds, seed=None, density=None, chromatic=0):
+    rng = _fresh_rng if seed is None else np.random.RandomState(int(seed))
+    shape = (width, n_leds, 3) if chromatic else (width, n_leds)
+    values = rng.random_sample(shape)
+    if density is not None: # binary noise with the given fraction of lit pixels
+        values = (values < density).astype(np.float64)
+    return values
+
+
+def bars(width, n_leds, columns=(0,), bar_width=1):
+    image = np.zeros((width, n_leds))
+    if not isinstance(columns, tuple):
+        columns = (columns,)
+    for column in columns:
+        image[int(column):int(column) + int(bar_width)] = 1.0
+    return image
+
+
+# Turn an intensity image (width, n_leds[, 3]) in 0..1 into a frame bank
+def to_frame_bank(image, color, color_order, gamma, color_balance, vflip, n_phases=1):
+    if image.ndim == 2:
+        image = image[:, :, np.newaxis] * (np.asarray(color, dtype=np.float64) / 255.0)
+    else:
+        image = image * (np.asarray(color, dtype=np.float64) / 255.0)
+    if vflip in (True, 'true'): # input end of the strip at the bottom
+        image = image[:, ::-1]
+    width, n_leds = image.shape[0], image.shape[1]
+    bank = np.empty((n_phases, width, n_leds, 4), dtype=np.uint8)
+    bank[..., 0] = 0xFF
+    order = color_order.lower()
+    # dither thresholds of every phase, shifted along the strip so that
+    # neighbouring LEDs do not step up at the same time
+    thresholds = [((p + np.arange(n_leds)) % n_phases + 0.5) / n_phases for p in range(n_phases)]
+    for c, name in enumerate('rgb'): # same byte offsets as Adafruit_DotStar
+        channel = np.power(np.clip(image[:, :, c], 0, 1), gamma[c]) * color_balance[c]
+        index = order.index(name) + 1
+        if n_phases == 1:
+            bank[0, :, :, index] = np.rint(channel).astype(np.uint8)
+            continue
+        for p in range(n_phases): # the phases average to the target
+            bank[p, :, :, index] = np.minimum(255, np.floor(channel + thresholds[p])).astype(np.uint8)
+    bank = bank.reshape(n_phases, width, n_leds * 4)
+    return indexed_bank(bank[0] if n_phases == 1 else bank)
+
+
+GENERATORS = {'grating': grating, 'noise': noise, 'bars': bars}
+
+
+# Frame bank for a spec; cached by spec and processing parameters
+def make_procedural_bank(spec, n_leds, color_order, gamma, color_balance, vflip, n_phases=1):
+    kind, params = parse_spec(spec)
+    if kind not in GENERATORS:
+        raise ValueError('Unknown procedural stimulus: ' + spec)
+    fresh = (kind == 'noise' and 'seed' not in params)
+    key = (kind, tuple(sorted(params.items())), n_leds, color_order, tuple(gamma), tuple(color_balance), vflip, n_phases)
+    if not fresh and key in _cache:
+        _cache[key] = _cache.pop(key) # most recently used
+        return _cache[key]
+    width = int(params.pop('width', 45))
+    color = params.pop('color', (255, 255, 255))
+    bank = to_frame_bank(GENERATORS[kind](width, n_leds, **params), color, color_order, gamma, color_balance, vflip,
+        n_phases)
+    if not fresh:
+        _cache[key] = bank
+        while len(_cache) > max_cached:
+            _cache.popitem(last=False)
+    return bank
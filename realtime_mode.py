@@ -0,0 +1,160 @@
+#!/usr/bin/python
+
+# --------------------------------------------------------------------------
+# Opt-in real-time mode for the presentation loop.
+#
+# dotstar.c pins the core clock with turboOn()/turboRestore() during bit-
+# bang, but the Python process itself can still be preempted mid-sweep by
+# the kernel scheduler, by page faults and by the cyclic garbage collector.
+# Real-time mode:
+# - switches the process to SCHED_FIFO (needs sudo, like the GPIO access),
+# - locks all current and future memory (mlockall) and pre-faults buffers,
+# - disables (or freezes) the garbage collector and only collects in the
+#   fix_time gaps between iterations.
+# Background I/O threads (background_thread) drop back to normal priority,
+# so they never compete with the sweeps.
+# The jitter helpers report percentiles of the time between 'shows', so that
+# runs with and without real-time mode can be compared.
+# --------------------------------------------------------------------------
+
+import gc
+import os
+import time
+import ctypes
+import threading
+import ctypes.util
+import numpy as np
+
+SCHED_OTHER, SCHED_FIFO = 0, 1
+MCL_CURRENT, MCL_FUTURE = 1, 2
+PAGE_SIZE = 4096
+jitter_percentiles = (50, 90, 99, 100) # which percentiles to report
+
+_libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+
+
+class _sched_param(ctypes.Structure):
+    _fields_ = [('sched_priority', ctypes.c_int)]
+
+
+# Switch the calling process to another scheduling policy
+def set_scheduler(policy, priority):
+    if hasattr(os, 'sched_setscheduler'): # Python 3
+        os.sched_setscheduler(0, policy, os.sched_param(priority))
+    elif _libc.sched_setscheduler(0, policy, ctypes.byref(_sched_param(priority))) != 0:
+        errno = ctypes.get_errno()
+        raise OSError(errno, os.strerror(errno))
+
+
+# Lock all current and future pages of the process into RAM
+def lock_memory():
+    if _libc.mlockall(MCL_CURRENT | MCL_FUTURE) != 0:
+        errno = ctypes.get_errno()
+        raise OSError(errno, os.strerror(errno))
+
+
+# Touch every page of the given buffers, so they are not faulted in mid-sweep.
+# Works with numpy arrays (e.g. frame banks) and bytearrays; read-only
+# buffers (strings) are only read.
+def prefault(buffers):
+    for buf in buffers:
+        data = np.frombuffer(buf, dtype=np.uint8) if not isinstance(buf, np.ndarray) else buf.reshape(-1).view(np.uint8)
+        if data.size == 0:
+            continue
+        if data.flags.writeable:
+            data[::PAGE_SIZE] = data[::PAGE_SIZE] # write back the same values
+        else:
+            data[::PAGE_SIZE].sum()
+
+
+# Enter real-time mode. Failures (e.g. not running as root) are reported but
+# not fatal, so the demo still runs, just without the protection.
+def enter_realtime(priority=50, buffers=()):
+    try:
+        set_scheduler(SCHED_FIFO, priority)
+        print('--> real-time: SCHED_FIFO, priority ' + str(priority))
+    except OSError as e:
+        print('--> real-time: could not set SCHED_FIFO (' + str(e) + ')')
+    try:
+        lock_memory()
+        print('--> real-time: memory locked')
+    except OSError as e:
+        print('--> real-time: could not lock memory (' + str(e) + ')')
+    prefault(buffers)
+    # move everything allocated so far out of the collector's reach
+    gc.collect()
+    if hasattr(gc, 'freeze'): # Python 3.7+
+        gc.freeze()
+    gc.disable()
+
+
+# Back to normal scheduling, memory and garbage collection
+def leave_realtime():
+    try:
+        set_scheduler(SCHED_OTHER, 0)
+    except OSError:
+        pass
+    _libc.munlockall()
+    if hasattr(gc, 'unfreeze'):
+        gc.unfreeze()
+    gc.enable()
+
+
+# Run the calling thread with normal priority again
+def normal_priority():
+    try:
+        set_scheduler(SCHED_OTHER, 0) # Linux: applies to the calling thread only
+    except OSError:
+        pass
+
+
+# Daemon thread for background I/O (logger, metrics server, clock sync, USB
+# ingest). Threads inherit SCHED_FIFO from the thread that starts them, so
+# these drop to normal priority first and never compete with the sweeps.
+def background_thread(target):
+    def run():
+        normal_priority()
+        target()
+    thread = threading.Thread(target=run)
+    thread.daemon = True
+    return thread
+
+
+# Collect garbage in a gap between sweeps and sleep for the rest of the gap.
+def collect_in_gap(gap):
+    startTime = time.time()
+    gc.collect()
+    sleep_for_time = gap - (time.time() - startTime)
+    if sleep_for_time > 0:
+        time.sleep(sleep_for_time)
+
+
+# Inter-show intervals [ms] of one presentation (the last timestamp is the
+# clear at the end of the presentation, as returned by run_paint)
+def inter_show_intervals(frame_times):
+    return np.diff(frame_times[0:len(frame_times)-1]) * 1000
+
+
+# Percentiles of inter-show intervals [ms], rounded for printing
+def get_jitter(intervals):
+    if len(intervals) == 0:
+        return [0.0 for p in jitter_percentiles]
+    return [round(float(v), 3) for v in np.percentile(intervals, jitter_percentiles)]
+
+
+# Run the same sweep n_sweeps times without and then with real-time mode and
+# print the jitter percentiles of both. run_sweep() must return frame_times.
+# Real-time mode stays on afterwards (see leave_realtime).
+def benchmark_jitter(run_sweep, n_sweeps, priority=50, buffers=()):
+    results = []
+    for realtime in (False, True):
+        if realtime:
+            enter_realtime(priority, buffers)
+        intervals = []
+        for n in range(n_sweeps):
+            intervals.extend(inter_show_intervals(run_sweep()))
+        results.append(get_jitter(intervals))
+    print('Inter-show interval percentiles ' + str(list(jitter_percentiles)) + ' [ms]:')
+    print('--> normal mode:    ' + str(results[0]))
+    print('--> real-time mode: ' + str(results[1]))
+    return results
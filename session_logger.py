@@ -0,0 +1,162 @@
+#!/usr/bin/python
+
+# --------------------------------------------------------------------------
+# Buffered, columnar session logger: one record per strip presentation.
+#
+# Records are collected in memory (one list per column) and handed over in
+# batches to a background thread, which appends them to the session file.
+# So logging never does file I/O in the display loop.
+#
+# File format (append-only): the magic line, then one block per batch:
+#   uint32 (little endian) length of the block header
+#   block header: JSON {"n": n_records, "columns": [[name, dtype, nbytes], ...]}
+#   the raw bytes of every column, in the order of the header
+# A block that was cut short (e.g. power loss) is ignored by the reader.
+#
+# Usage: python session_logger.py <session file>  (prints a summary)
+# --------------------------------------------------------------------------
+
+import os
+import sys
+import json
+import struct
+import numpy as np
+from realtime_mode import background_thread
+try:
+    import queue # Python 3
+except ImportError:
+    import Queue as queue # Python 2
+
+MAGIC = b'PVLOG1\n'
+# columns of a record and their types ('S': UTF-8 byte string of any length)
+LOG_COLUMNS = [('iteration', '<i4'), ('image_set', '<i4'), ('strip', '<i2'), ('file_name', 'S'),
+    ('display_dur', '<f4'), ('inter_dur', '<f4'), ('brightness', '<i2'), ('direction', '<i1'),
+    ('pres_dur', '<f4'), ('n_shows', '<i4'), ('onset', '<f8')]
+
+
+# Text as UTF-8 bytes; names that are not valid text (e.g. from a USB stick)
+# get replacement characters instead of stopping the log
+def _utf8(value):
+    if isinstance(value, bytes): # Python 2 str: written as it is
+        return value
+    if not isinstance(value, type(u'')):
+        value = str(value)
+    return value.encode('utf-8', 'replace')
+
+
+class SessionLogger(object):
+    def __init__(self, filename, batch_size=256):
+        self.filename = filename
+        self.batch_size = batch_size
+        self.n_logged = 0
+        self._new_batch()
+        # the file is only touched by the writer thread
+        self._queue = queue.Queue()
+        self._writer = background_thread(self._write_batches)
+        self._writer.start()
+
+    def _new_batch(self):
+        self._batch = dict((name, []) for name, dtype in LOG_COLUMNS)
+        self._n_batch = 0
+
+    # Log one presentation. Only appends to lists; full batches are passed to
+    # the writer thread.
+    def log(self, iteration, image_set, strip, file_name, display_dur, inter_dur,
+            brightness, direction, pres_dur, n_shows, onset):
+        batch = self._batch
+        batch['iteration'].append(iteration)
+        batch['image_set'].append(image_set)
+        batch['strip'].append(strip)
+        batch['file_name'].append(file_name)
+        batch['display_dur'].append(display_dur)
+        batch['inter_dur'].append(inter_dur)
+        batch['brightness'].append(brightness)
+        batch['direction'].append(direction)
+        batch['pres_dur'].append(pres_dur)
+        batch['n_shows'].append(n_shows)
+        batch['onset'].append(onset)
+        self._n_batch += 1
+        self.n_logged += 1
+        if self._n_batch >= self.batch_size:
+            self.flush()
+
+    # Hand the current batch to the writer thread (does not wait for the write)
+    def flush(self):
+        if self._n_batch > 0:
+            self._queue.put((self._batch, self._n_batch))
+            self._new_batch()
+
+    # Write everything that is left and stop the writer thread
+    def close(self):
+        self.flush()
+        self._queue.put(None)
+        self._writer.join()
+
+    def _write_batches(self):
+        new_file = not os.path.exists(self.filename) or os.path.getsize(self.filename) == 0
+        with open(self.filename, 'ab') as f:
+            if new_file:
+                f.write(MAGIC)
+            while True:
+                item = self._queue.get()
+                if item is None:
+                    break
+                batch, n = item
+                columns = []
+                header = []
+                for name, dtype in LOG_COLUMNS:
+                    values = [_utf8(v) for v in batch[name]] if dtype == 'S' else batch[name]
+                    column = np.array(values, dtype=dtype)
+                    columns.append(column)
+                    header.append([name, column.dtype.str, column.nbytes])
+                header = json.dumps({'n': n, 'columns': header}).encode('utf-8')
+                f.write(struct.pack('<I', len(header)))
+                f.write(header)
+                for column in columns:
+                    f.write(column.tobytes())
+                f.flush()
+
+
+# Load a whole session file into a dict of arrays (one per column)
+def load_session(filename):
+    blocks = dict((name, []) for name, dtype in LOG_COLUMNS)
+    with open(filename, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(filename + ' is not a session log')
+        while True:
+            size = f.read(4)
+            if len(size) < 4:
+                break
+            header = f.read(struct.unpack('<I', size)[0])
+            try:
+                header = json.loads(header.decode('utf-8'))
+            except ValueError:
+                break # incomplete block at the end of the file
+            block = {}
+            for name, dtype, nbytes in header['columns']:
+                data = f.read(nbytes)
+                if len(data) < nbytes:
+                    break
+                block[name] = np.frombuffer(data, dtype=dtype)
+            if len(block) < len(header['columns']):
+                break # incomplete block at the end of the file
+            for name in blocks:
+                if name in block:
+                    blocks[name].append(block[name])
+    session = {}
+    for name, dtype in LOG_COLUMNS:
+        if blocks[name]:
+            session[name] = np.concatenate(blocks[name])
+        else:
+            session[name] = np.array([], dtype=dtype)
+    return session
+
+
+if __name__ == '__main__':
+    session = load_session(sys.argv[1])
+    print('Records: ' + str(len(session['onset'])))
+    for strip in np.unique(session['strip']):
+        this_strip = session['strip'] == strip
+        print('Strip ' + str(strip+1) + ': n=' + str(np.sum(this_strip)) +
+            ', mean duration=' + str(round(float(np.mean(session['pres_dur'][this_strip])), 2)) + ' ms' +
+            ', mean shows=' + str(round(float(np.mean(session['n_shows'][this_strip])), 1)))
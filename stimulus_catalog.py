@@ -0,0 +1,233 @@
+#!/usr/bin/python
+
+# --------------------------------------------------------------------------
+# Stimulus catalog: a persistent index of every stimulus in image_path and
+# the named image sets that are shown with the interface.
+#
+# Image sets are defined in a JSON file next to the script, in the order of
+# the number keys and the slider:
+#   {"sets": [{"name": "colour-test", "files": ["TestColourOrder.jpg", ...]},
+#             ...]}
+# Sets can have any name and there can be any number of them; the files of a
+# set are the stimuli of the strips (or presentations), in order. Instead of
+# a file name, a procedural stimulus can be given (see procedural_stimuli.py).
+#
+# The index records for every image file:
+#   width, height (from the image header), size, mtime, content hash (sha1),
+#   status: 'image' (shown as is), 'resize' (height is scaled to the strip),
+#           'stream' (processed in tiles, see streaming_columns.py) or
+#           'unreadable'
+#   peak_ma: estimated peak current of a column at full brightness [mA],
+#            only computed for files used in a set (check_current)
+# Files are only re-read when their size or mtime changed. The index is a
+# generated file, so it is kept in a cache directory (not in image_path), one
+# per image_path, strip length and stream_min_width. The stimulus registry
+# takes its content hashes from here (content_hash). Building the
+# catalog checks every set: sets of the wrong size are an error, missing or
+# unreadable files (also absolute paths, e.g. ingested from USB) are reported
+# as a warning, and index_of() refuses such a set when it is selected.
+#
+# Print the catalog with:
+#   python stimulus_catalog.py image_path [sets_file]
+# --------------------------------------------------------------------------
+
+import os
+import sys
+import json
+import hashlib
+import collections
+import errno
+import numpy as np
+from PIL import Image
+from procedural_stimuli import is_procedural
+from usb_ingest import path_bytes
+
+default_cache_path = os.path.expanduser('~/.cache/pv-catalog') # index files (not next to the stimuli)
+HASH_CHUNK = 1 << 20 # files are hashed in chunks of this many bytes
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.gif')
+ma_per_channel = 20.0 # DotStar current of one color channel at full intensity [mA]
+ma_idle_per_led = 1.0 # DotStar current of a dark LED [mA]
+max_estimate_width = 4096 # wider images are scaled down horizontally for the current estimate
+
+
+class StimulusCatalog(object):
+    def __init__(self, image_path, sets_file, n_leds, gamma, color_balance_factors, stream_min_width=0, cache_path=None):
+        self.image_path = image_path
+        self.sets_file = sets_file
+        self.cache_path = cache_path or default_cache_path
+        signature = '%s:%d:%d' % (os.path.abspath(image_path), n_leds, stream_min_width)
+        self.index_file = os.path.join(self.cache_path, 'catalog_' + hashlib.sha1(path_bytes(signature)).hexdigest()[0:16] + '.json')
+        self.n_leds = n_leds
+        self.gamma = gamma
+        self.color_balance_factors = color_balance_factors
+        self.stream_min_width = stream_min_width
+        self.stimuli = {} # file name -> index entry
+        self.sets = collections.OrderedDict() # set name -> file names
+        self._set_index = {} # set name -> position in sets
+        self.problems = {} # set name -> missing or unreadable files
+        self._dirty = False # peak currents added since the index was saved
+
+    # Scan image_path, update the index and check all sets (of set_size
+    # files, if given). Raises ValueError listing sets defined twice or of
+    # the wrong size, and warns about sets with missing or unreadable files.
+    def build(self, set_size=None):
+        old = {}
+        if os.path.exists(self.index_file):
+            with open(self.index_file) as f:
+                old = json.load(f).get('stimuli', {})
+        self.stimuli = {}
+        for filename in sorted(os.listdir(self.image_path)):
+            if filename.lower().endswith(IMAGE_EXTENSIONS):
+                self.stimuli[filename] = self._index_entry(filename, old.get(filename))
+        if self.stimuli != old:
+            self.save()
+        with open(self.sets_file) as f:
+            sets = json.load(f)['sets']
+        self.sets = collections.OrderedDict()
+        self.problems = {}
+        errors = []
+        for image_set in sets:
+            name, files = image_set['name'], list(image_set['files'])
+            if name in self.sets:
+                errors.append('set ' + name + ': defined twice')
+            if set_size is not None and len(files) != set_size:
+                errors.append('set ' + name + ': ' + str(len(files)) + ' files, needs ' + str(set_size))
+            self.sets[name] = files
+            self._check_set(name)
+        if errors:
+            raise ValueError('Stimulus catalog ' + self.sets_file + ':\n  ' + '\n  '.join(errors))
+        self._set_index = dict((name, i) for i, name in enumerate(self.sets))
+        for name in self.problems:
+            print('Warning! Set ' + name + ' cannot be shown: ' + '; '.join(self.problems[name]))
+
+    def _check_set(self, name):
+        problems = [filename + ' ' + self.check(filename) for filename in self.sets[name] if self.check(filename)]
+        if problems:
+            self.problems[name] = problems
+
+    # Index entry of one file; reused if size and mtime are unchanged
+    def _index_entry(self, filename, old_entry):
+        path = os.path.join(self.image_path, filename)
+        stat = os.stat(path)
+        if old_entry is not None and old_entry['size'] == stat.st_size and old_entry['mtime'] == stat.st_mtime:
+            return old_entry
+        entry = {'size': stat.st_size, 'mtime': stat.st_mtime}
+        sha1 = hashlib.sha1()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(HASH_CHUNK), b''):
+                sha1.update(chunk)
+        entry['hash'] = sha1.hexdigest()
+        try:
+            entry['width'], entry['height'] = Image.open(path).size # reads the header only
+        except IOError:
+            entry['status'] = 'unreadable'
+            return entry
+        if self.stream_min_width > 0 and entry['width'] >= self.stream_min_width:
+            entry['status'] = 'stream'
+        elif entry['height'] != self.n_leds:
+            entry['status'] = 'resize'
+        else:
+            entry['status'] = 'image'
+        return entry
+
+    # Estimated current of the brightest column at full brightness [mA],
+    # with the gamma and color balance of the interface
+    def peak_current(self, img):
+        img = img.resize((min(img.size[0], max_estimate_width), self.n_leds), Image.BICUBIC)
+        pixels = np.asarray(img, dtype=np.float64) / 255.0 # (n_leds, width, 3)
+        channels = [np.power(pixels[:, :, c], self.gamma[c]) * self.color_balance_factors[c] for c in range(3)]
+        columns = sum(channel.sum(axis=0) for channel in channels) # full intensity channels per column
+        return int(round(columns.max() * ma_per_channel + self.n_leds * ma_idle_per_led))
+
+    # Problem with a file name used in a set ('' if none). Absolute paths
+    # (outside image_path) are only checked for existence.
+    def check(self, filename):
+        if is_procedural(filename):
+            return ''
+        if os.path.isabs(filename):
+            return '' if os.path.isfile(filename) else 'is missing'
+        entry = self.stimuli.get(filename)
+        if entry is None:
+            return 'is missing in ' + self.image_path
+        if entry['status'] == 'unreadable':
+            return 'cannot be read'
+        return ''
+
+    # Content hash of an indexed file, if it is unchanged since indexing (None otherwise)
+    def content_hash(self, filename):
+        entry = self.stimuli.get(filename)
+        if entry is None:
+            return None
+        try:
+            stat = os.stat(os.path.join(self.image_path, filename))
+        except OSError:
+            return None
+        if entry['size'] != stat.st_size or entry['mtime'] != stat.st_mtime:
+            return None
+        return entry['hash']
+
+    def save(self):
+        try:
+            try:
+                os.makedirs(self.cache_path)
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+            with open(self.index_file + '.tmp', 'w') as f:
+                json.dump({'stimuli': self.stimuli}, f, indent=1, sort_keys=True)
+            os.rename(self.index_file + '.tmp', self.index_file)
+        except (IOError, OSError) as e:
+            print('Warning! Could not write ' + self.index_file + ' (' + str(e) + ')')
+
+    def set_names(self):
+        return list(self.sets)
+
+    # Position of a set; raises ValueError if it has missing or unreadable files
+    def index_of(self, name):
+        if name in self.problems:
+            raise ValueError('Set ' + name + ' cannot be shown: ' + '; '.join(self.problems[name]))
+        return self._set_index[name]
+
+    # Add a set at runtime (e.g. images ingested from USB)
+    def add_set(self, name, files):
+        self._set_index[name] = len(self.sets)
+        self.sets[name] = list(files)
+        self._check_set(name)
+
+    # Estimated peak current of an indexed file [mA] (decoded once, then kept in the index)
+    def peak_ma(self, filename):
+        entry = self.stimuli.get(filename)
+        if entry is None or entry['status'] == 'unreadable':
+            return 0
+        if 'peak_ma' not in entry:
+            entry['peak_ma'] = self.peak_current(Image.open(os.path.join(self.image_path, filename)).convert('RGB'))
+            self._dirty = True
+        return entry['peak_ma']
+
+    # Warn about sets whose stimuli LightPaint will dim to stay within the
+    # peak current (power_settings[1])
+    def check_current(self, peak_limit):
+        for name in self.sets:
+            over = [f for f in self.sets[name] if self.peak_ma(f) > peak_limit]
+            if over:
+                print('Note: set ' + name + ' exceeds ' + str(peak_limit) + ' mA at full brightness (' +
+                    ', '.join(f + ': ' + str(self.stimuli[f]['peak_ma']) + ' mA' for f in over) + ')')
+        if self._dirty:
+            self.save()
+            self._dirty = False
+
+
+if __name__ == '__main__':
+    image_path = sys.argv[1]
+    sets_file = sys.argv[2] if len(sys.argv) > 2 else 'stimulus_sets.json'
+    catalog = StimulusCatalog(image_path, sets_file, 144, (2.8, 2.8, 2.8), (0.5, 1, 0.75), 4096)
+    catalog.build()
+    catalog.check_current(1e9) # fill in the peak currents
+    print('%-26s %6s %6s  %-10s %8s  %s' % ('file', 'width', 'height', 'status', 'peak mA', 'hash'))
+    for filename in sorted(catalog.stimuli):
+        entry = catalog.stimuli[filename]
+        print('%-26s %6s %6s  %-10s %8s  %s' % (filename, entry.get('width', '-'), entry.get('height', '-'),
+            entry['status'], entry.get('peak_ma', '-'), entry['hash'][0:12]))
+    print('')
+    for name in catalog.sets:
+        print(str(catalog.index_of(name)) + ': ' + name + ' = ' + ', '.join(catalog.sets[name]))
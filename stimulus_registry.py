@@ -0,0 +1,84 @@
+#!/usr/bin/python
+
+# --------------------------------------------------------------------------
+# Content-addressed registry of processed stimuli.
+#
+# The same image is often used on several strips, in several image sets or
+# for several presentations (e.g. TestColourOrder.jpg four times in set 0).
+# The registry processes every unique (file content, processing parameters)
+# pair only once and hands out the same LightPaint object (and frame bank)
+# to everybody who asks for it. Entries are reference counted and dropped
+# when the last user releases them, so memory scales with unique stimuli.
+# Content hashes are taken from the stimulus catalog, if one is given and the
+# file is indexed, so files are not hashed twice.
+# --------------------------------------------------------------------------
+
+import os
+import hashlib
+from frame_bank import make_frame_bank, shared_frame_bank, bank_phases
+
+
+class StimulusRegistry(object):
+    def __init__(self, image_path, catalog=None):
+        self.image_path = image_path
+        self.catalog = catalog
+        self.entries = {} # key -> {'lightpaint', 'width', 'refs', 'frame_bank'}
+        self._hashes = {} # path -> ((size, mtime), content hash)
+
+    # Hash of the file content; cached as long as size and mtime are unchanged
+    def content_hash(self, filename):
+        if self.catalog is not None:
+            indexed = self.catalog.content_hash(filename)
+            if indexed is not None:
+                return indexed
+        path = os.path.join(self.image_path, filename)
+        stat = os.stat(path)
+        signature = (stat.st_size, stat.st_mtime)
+        cached = self._hashes.get(path)
+        if cached is not None and cached[0] == signature:
+            return cached[1]
+        sha = hashlib.sha1()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(65536), b''):
+                sha.update(chunk)
+        self._hashes[path] = (signature, sha.hexdigest())
+        return self._hashes[path][1]
+
+    # Get the processed stimulus for a file. 'params' is a hashable tuple of
+    # everything that changes the processing (strip length, brightness, ...),
+    # 'load' is called without arguments on a miss and must return
+    # (lightpaint, img_width). Returns lightpaint, img_width and the key that
+    # must be passed to release().
+    def acquire(self, filename, params, load):
+        key = (self.content_hash(filename), params)
+        entry = self.entries.get(key)
+        if entry is None:
+            lightpaint, img_width = load()
+            entry = {'lightpaint': lightpaint, 'width': img_width, 'refs': 0, 'frame_bank': None}
+            self.entries[key] = entry
+        entry['refs'] += 1
+        return entry['lightpaint'], entry['width'], key
+
+    def release(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            return
+        entry['refs'] -= 1
+        if entry['refs'] <= 0:
+            del self.entries[key]
+            if hasattr(entry['lightpaint'], 'close'): # streams stop their read-ahead thread
+                entry['lightpaint'].close()
+
+    def release_all(self, keys):
+        for key in keys:
+            self.release(key)
+
+    # Shared-memory frame bank of an acquired stimulus, built on first use
+    def frame_bank(self, key, ledBuffer, n_phases=1):
+        entry = self.entries[key]
+        if entry['frame_bank'] is None or bank_phases(entry['frame_bank']) != n_phases:
+            entry['frame_bank'] = shared_frame_bank(make_frame_bank(entry['lightpaint'], ledBuffer, entry['width'], n_phases))
+        return entry['frame_bank']
+
+    def __len__(self):
+        return len(self.entries)
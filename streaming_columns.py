@@ -0,0 +1,270 @@
+#!/usr/bin/python
+
+# --------------------------------------------------------------------------
+# Bounded-memory streaming of very wide (panoramic) stimuli.
+#
+# loadImage keeps the full width of an image and LightPaint processes all of
+# it at once, so a wide image is held in memory several times (decoded image,
+# the string from tostring(), LightPaint's buffers). For images tens of
+# thousands of columns wide this does not fit on a small Pi.
+#
+# A ColumnStream instead:
+# - decodes the image once into a column-major raw cache file (.npy) in a
+#   cache directory of its own, memory-mapped, so the kernel can drop its
+#   pages at any time,
+# - cuts it into tiles of 'tile_cols' columns, runs LightPaint on one tile
+#   at a time and renders the tile into strip-ready rows (see frame_bank.py),
+# - limits the power once for the whole image: the scale that keeps it
+#   within power_settings is computed from the cache file (same current model
+#   as stimulus_catalog.py) and applied to the color balance of every tile,
+#   while LightPaint's own limiting is off, so tiles are never dimmed
+#   differently (no brightness steps at tile seams),
+# - keeps the first and the last tile (where forward and reversed sweeps
+#   start) rendered for as long as the stream is open, so a sweep never
+#   waits before its first show,
+# - keeps at most 'n_resident' other tiles in memory and prepares the tiles
+#   of the next columns the sweep will show in a background thread. The
+#   sweep reports its column and stride (columns per show), so tiles that a
+#   fast sweep skips are never rendered. In the gap after a sweep, the
+#   tiles of the next sweep are queued.
+# close() stops the background thread and frees the tiles; the thread keeps
+# the stream alive until then.
+# --------------------------------------------------------------------------
+
+import os
+import math
+import time
+import errno
+import hashlib
+import threading
+import collections
+import numpy as np
+from PIL import Image
+from frame_bank import make_frame_bank
+from monotonic_clock import monotonic
+from usb_ingest import path_bytes
+from stimulus_catalog import ma_per_channel, ma_idle_per_led
+
+default_cache_path = os.path.expanduser('~/.cache/pv-streams') # raw column caches (not next to the stimuli)
+UNLIMITED_POWER = (100000, 100000) # [mA] power_settings for tile LightPaints: the stream limits the power itself
+
+
+# Width of an image file without decoding it
+def image_width(path):
+    return Image.open(path).size[0]
+
+
+# Scale (0..1) of the color balance that keeps an image within
+# power_settings (average, peak) [mA]. columns: (width, n_leds, 3) uint8,
+# color_balance: maximum value per channel (0..255).
+def power_scale(columns, gamma, color_balance, power_settings, slab_cols=256):
+    width, n_leds = columns.shape[0], columns.shape[1]
+    total, peak = 0.0, 0.0
+    for x0 in range(0, width, slab_cols):
+        pixels = columns[x0:x0 + slab_cols] / 255.0
+        currents = sum(np.power(pixels[:, :, c], gamma[c]).sum(axis=1) * (color_balance[c] / 255.0) for c in range(3))
+        total += currents.sum()
+        peak = max(peak, currents.max())
+    idle = n_leds * ma_idle_per_led
+    average, peak = total / width * ma_per_channel, peak * ma_per_channel
+    scale = 1.0
+    if average > 0:
+        scale = min(scale, max(0.0, power_settings[0] - idle) / average)
+    if peak > 0:
+        scale = min(scale, max(0.0, power_settings[1] - idle) / peak)
+    return scale
+
+
+class ColumnStream(object):
+    # make_lightpaint(pixels, size, color_balance) must return a LightPaint
+    # object for the given raw RGB string and color balance, with the other
+    # processing settings of the interface and power_settings=UNLIMITED_POWER.
+    # power = (gamma, color_balance, power_settings) of the interface.
+    def __init__(self, path, n_leds, make_lightpaint, power, tile_cols=256, n_resident=4, cache_path=None):
+        self.path = path
+        self.n_leds = n_leds
+        self.make_lightpaint = make_lightpaint
+        self.tile_cols = tile_cols
+        self.n_resident = max(2, n_resident)
+        self.columns = self._open_source(cache_path or default_cache_path)
+        self.width = self.columns.shape[0]
+        self.n_tiles = (self.width + tile_cols - 1) // tile_cols
+        gamma, color_balance, power_settings = power
+        scale = power_scale(self.columns, gamma, color_balance, power_settings)
+        self.color_balance = tuple(int(c * scale) for c in color_balance) # the same for every tile
+        self.tile_time = 0.0 # measured time to prepare one tile [s]
+        self.misses = 0      # tiles the sweep had to wait for
+        self.stride = 1.0    # columns per show of the last sweep
+        self._tiles = collections.OrderedDict() # tile index -> rows, least recently used first
+        self._lock = threading.Lock()
+        self._wanted = None # (tile, direction) the read-ahead is working from
+        self._column = 0
+        self._stride = 1.0 # columns per show, negative for reversed sweeps
+        self._wake = threading.Event()
+        self._closed = False
+        self._pinned = dict((t, self._render_tile(t)) for t in set([0, self.n_tiles - 1])) # sweeps start here
+        self._worker = threading.Thread(target=self._prefetch_tiles)
+        self._worker.daemon = True
+        self._worker.start()
+
+    # Decode the image once into a memory-mapped, column-major cache file
+    # of shape (width, n_leds, 3)
+    def _open_source(self, cache_path):
+        try:
+            os.makedirs(cache_path)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+        stat = os.stat(self.path)
+        signature = '%s:%d:%d:%d' % (os.path.abspath(self.path), stat.st_size, int(stat.st_mtime), self.n_leds)
+        cache_file = os.path.join(cache_path, 'stream_' + hashlib.sha1(path_bytes(signature)).hexdigest()[0:16] + '.npy')
+        if not os.path.exists(cache_file):
+            img = Image.open(self.path).convert('RGB')
+            if img.size[1] != self.n_leds: # same vertical scaling as loadImage
+                img = img.resize((img.size[0], self.n_leds), Image.BICUBIC)
+            columns = np.lib.format.open_memmap(cache_file + '.tmp', mode='w+', dtype=np.uint8,
+                shape=(img.size[0], self.n_leds, 3))
+            # copy in vertical slabs, so only one slab is transposed at a time
+            for x0 in range(0, img.size[0], self.tile_cols):
+                x1 = min(x0 + self.tile_cols, img.size[0])
+                slab = np.asarray(img.crop((x0, 0, x1, self.n_leds)), dtype=np.uint8)
+                columns[x0:x1] = slab.transpose(1, 0, 2)
+            columns.flush()
+            del columns, img
+            os.rename(cache_file + '.tmp', cache_file)
+        return np.load(cache_file, mmap_mode='r')
+
+    # Render one tile: LightPaint on the tile's columns only
+    def _render_tile(self, t):
+        startTime = monotonic()
+        x0 = t * self.tile_cols
+        x1 = min(x0 + self.tile_cols, self.width)
+        pixels = np.ascontiguousarray(self.columns[x0:x1].transpose(1, 0, 2)).tobytes()
+        lightpaint = self.make_lightpaint(pixels, (x1 - x0, self.n_leds), self.color_balance)
+        rows = make_frame_bank(lightpaint, bytearray(self.n_leds * 4), x1 - x0) # private LED buffer
+        self.tile_time = monotonic() - startTime
+        return rows
+
+    def _store(self, t, rows):
+        if t in self._pinned:
+            return
+        with self._lock:
+            self._tiles[t] = rows
+            while len(self._tiles) > self.n_resident:
+                self._tiles.popitem(last=False)
+
+    # Tiles of the columns column, column + stride, ... (as many as can be
+    # resident besides the current one)
+    def upcoming_tiles(self, column, stride):
+        tiles = []
+        x = float(column)
+        while 0 <= x < self.width and len(tiles) < self.n_resident - 1:
+            t = int(x) // self.tile_cols
+            tiles.append(t)
+            # first column of the schedule past tile t
+            edge = (t + 1) * self.tile_cols if stride > 0 else t * self.tile_cols - 1
+            x += max(1, math.ceil((edge - x) / stride)) * stride
+        return tiles
+
+    def _prefetch_tiles(self):
+        while True:
+            self._wake.wait()
+            self._wake.clear()
+            if self._closed:
+                return
+            wanted = self._wanted
+            for t in self.upcoming_tiles(self._column, self._stride):
+                if self._wanted != wanted or self._closed:
+                    break # the sweep moved on, start over
+                with self._lock:
+                    resident = t in self._tiles or t in self._pinned
+                if not resident:
+                    self._store(t, self._render_tile(t))
+
+    # Ask the background thread to have the tiles of the next columns ready:
+    # column, column + stride, ... (stride: columns per show, negative for
+    # reversed sweeps). Wakes it only when the sweep enters another tile.
+    def prefetch(self, column, stride=1.0):
+        if stride == 0:
+            stride = 1.0
+        self._stride = stride
+        wanted = (column // self.tile_cols, stride > 0)
+        if self._wanted != wanted:
+            self._column = column
+            self._wanted = wanted
+            self._wake.set()
+
+    # Strip-ready row of column c
+    def column(self, c):
+        t = c // self.tile_cols
+        rows = self._pinned.get(t)
+        if rows is None:
+            with self._lock:
+                rows = self._tiles.get(t)
+        if rows is None: # read-ahead fell behind: render it here
+            self.misses += 1
+            rows = self._render_tile(t)
+            self._store(t, rows)
+        return rows[c - t * self.tile_cols]
+
+    # Queue the tiles of the next sweep (the last tiles for a reversed sweep)
+    # with the stride of the last sweep, without waiting for them
+    def queue_sweep(self, reverse=False):
+        self.prefetch(self.width - 1 if reverse else 0, -self.stride if reverse else self.stride)
+
+    # Stop the read-ahead and free the tiles and the memory map
+    def close(self):
+        self._closed = True
+        self._wake.set()
+        self._worker.join(10.0)
+        with self._lock:
+            self._tiles.clear()
+        self._pinned = {}
+        self.columns = None
+
+    # Can the read-ahead keep up with a sweep of 'dur' seconds?
+    def keeps_up(self, dur):
+        if self.tile_time == 0 or dur <= 0:
+            return True
+        time_per_tile = dur * self.tile_cols / float(self.width)
+        return self.tile_time < time_per_tile
+
+
+# Same as run_paint, but for a ColumnStream. With reverse, the columns run
+# from last to first and the read-ahead runs backwards. The read-ahead
+# follows the stride of the sweep (columns per show so far).
+def run_paint_stream(dur, delay, stream, which_strip, reverse=False):
+    elapsed = 0 # time elapsed since startTime
+    frame_times = [] # here we'll list the timestamps
+    first_column = stream.width - 1 if reverse else 0
+    step = -1 if reverse else 1
+    stride = stream.stride
+    startTime = monotonic() # time at start of the presentation
+    if dur > 0:
+        while elapsed <= dur:
+            elapsed = monotonic() - startTime
+            column = int(elapsed / dur * stream.width)
+            if column >= stream.width:
+                column = stream.width - 1
+            column = abs(first_column - column)
+            stream.prefetch(column, step * stride) # keep reading ahead of the sweep
+            which_strip.show(stream.column(column)) # display the column
+            frame_times.append(monotonic() - startTime) # save the timestamp after the 'show' command
+            stride = max(1.0, stream.width * frame_times[-1] / (len(frame_times) * dur))
+    else:
+        print('Warning! Duration is zero')
+    # remove the display from the strip here
+    which_strip.clear()
+    which_strip.show()
+    break_time = monotonic()
+    frame_times.append(break_time - startTime) # last timestamp of presentation
+    stream.stride = stride
+    stream.queue_sweep(reverse) # render the next sweep's tiles during the gap (the first one is pinned)
+    if not stream.keeps_up(dur):
+        print('Warning! Read-ahead of ' + os.path.basename(stream.path) + ' cannot keep up (' +
+            str(round(stream.tile_time*1000, 1)) + ' ms per tile, ' + str(stream.misses) + ' misses)')
+    # wait for delay time (no need to timestamp this)
+    sleep_for_time = delay + dur - (break_time - startTime)
+    if sleep_for_time > 0:
+        time.sleep(sleep_for_time)
+    return frame_times
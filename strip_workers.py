@@ -0,0 +1,168 @@
+#!/usr/bin/python
+
+# --------------------------------------------------------------------------
+# One worker process per LED strip, each pinned to its own CPU core.
+#
+# In the default loop all strips are driven serially from one Python thread,
+# so the timing of strip 2 depends on how long strip 1 took to output. Here,
+# every strip gets a forked worker process that reads its frame bank (see
+# frame_bank.py) from shared memory. A central timeline in the parent process
+# computes the absolute onset of every presentation (including inter_durs
+# gaps; negative gaps give overlapping presentations) on the shared monotonic
+# clock and releases each worker for its onset. Workers report the measured
+# onset error, presentation duration and number of shows back to the parent.
+# --------------------------------------------------------------------------
+
+import os
+import signal
+import subprocess
+import multiprocessing
+import numpy as np
+from monotonic_clock import monotonic, sleep_until
+from frame_bank import run_paint_bank
+from priming import DarkStrip
+
+# layout of the shared control and result arrays (one row per strip)
+CTRL_ONSET, CTRL_DUR, CTRL_STOP, CTRL_REVERSE, CTRL_DARK = 0, 1, 2, 3, 4
+N_CTRL = 5
+RES_ONSET_ERR, RES_PRES_DUR, RES_N_SHOWS, RES_INTER_FRAME, RES_ONSET = 0, 1, 2, 3, 4
+N_RES = 5
+
+
+# Pin the calling process to one CPU core
+def set_cpu_affinity(core):
+    if hasattr(os, 'sched_setaffinity'): # Python 3
+        os.sched_setaffinity(0, [core])
+    else: # Python 2 on Raspbian: use taskset
+        with open(os.devnull, 'w') as devnull:
+            subprocess.call(['taskset', '-p', '-c', str(core), str(os.getpid())],
+                stdout=devnull, stderr=devnull)
+
+
+# Compute the presentation onsets of one cycle.
+# order: strip indices in presentation order. The gap inter_durs[k] follows
+# the presentation of strip k, as in the serial loop. Returns a list of
+# (strip index, onset, duration) with onsets on the monotonic clock [s].
+def make_timeline(display_durs, inter_durs, order, cycle_start):
+    timeline = []
+    onset = cycle_start
+    for k in order:
+        dur = display_durs[k] / 1000.0
+        timeline.append((k, onset, dur))
+        onset = max(cycle_start, onset + dur + inter_durs[k] / 1000.0)
+    return timeline
+
+
+def _strip_worker(k, strip, bank, core, ctrl, results, go, done, ready):
+    set_cpu_affinity(core)
+    # USB mount signals are for the parent (see usb_ingest.py); their default
+    # action would end the worker
+    signal.signal(signal.SIGUSR1, signal.SIG_IGN)
+    signal.signal(signal.SIGUSR2, signal.SIG_IGN)
+    dark_strip = DarkStrip(strip) # for priming sweeps (see priming.py)
+    ready.set() # start barrier: parent waits until all workers got here
+    while True:
+        go.wait()
+        go.clear()
+        if ctrl[k, CTRL_STOP] > 0:
+            break
+        # wait for our scheduled onset, then sweep
+        onset = ctrl[k, CTRL_ONSET]
+        sleep_until(onset)
+        actual_onset = monotonic()
+        frame_times = run_paint_bank(ctrl[k, CTRL_DUR], 0, bank, dark_strip if ctrl[k, CTRL_DARK] > 0 else strip,
+            ctrl[k, CTRL_REVERSE] > 0)
+        # report timing back
+        results[k, RES_ONSET_ERR] = actual_onset - onset
+        results[k, RES_ONSET] = actual_onset
+        results[k, RES_PRES_DUR] = frame_times[-1]
+        results[k, RES_N_SHOWS] = len(frame_times) - 1
+        if len(frame_times) > 2:
+            results[k, RES_INTER_FRAME] = np.mean(np.diff(frame_times[0:len(frame_times)-1]))
+        else:
+            results[k, RES_INTER_FRAME] = 0
+        done.set()
+
+
+class StripWorkerPool(object):
+    # strips: initialized Adafruit_DotStar objects, banks: shared frame banks,
+    # cores: CPU core per strip
+    def __init__(self, strips, banks, cores):
+        assert(len(strips) == len(banks) == len(cores))
+        self.n_strips = len(strips)
+        self.ctrl = np.frombuffer(multiprocessing.RawArray('d', self.n_strips*N_CTRL)).reshape(self.n_strips, N_CTRL)
+        self.results = np.frombuffer(multiprocessing.RawArray('d', self.n_strips*N_RES)).reshape(self.n_strips, N_RES)
+        self.go = [multiprocessing.Event() for k in range(self.n_strips)]
+        self.done = [multiprocessing.Event() for k in range(self.n_strips)]
+        self.ready = [multiprocessing.Event() for k in range(self.n_strips)]
+        self.last_onsets = [] # measured onsets of the last cycle (monotonic clock)
+        self.workers = []
+        for k in range(self.n_strips):
+            worker = multiprocessing.Process(target=_strip_worker,
+                args=(k, strips[k], banks[k], cores[k], self.ctrl, self.results,
+                    self.go[k], self.done[k], self.ready[k]))
+            worker.daemon = True
+            self.workers.append(worker)
+
+    def start(self, timeout=10.0):
+        for worker in self.workers:
+            worker.start()
+        for k in range(self.n_strips):
+            if not self.ready[k].wait(timeout):
+                raise RuntimeError('Strip worker ' + str(k+1) + ' did not start')
+
+    # Run one cycle: every strip once, in the given order. 'lead' is the time
+    # between publishing the timeline and the first onset [s], unless the
+    # onset is given as cycle_start (monotonic clock). With reverse, all
+    # strips show their columns from last to first. sweep_durs [ms] replace
+    # the deadlines of the sweeps (not the onsets), see duration_control.py.
+    # With dark, the strips stay dark (priming, see priming.py).
+    # Raises RuntimeError if a worker dies or is not done 'timeout' seconds
+    # after the end of its sweep.
+    # Returns pres_durs, n_shows, inter_frame_time [ms] and onset errors [ms]
+    # in presentation order.
+    def run_cycle(self, display_durs, inter_durs, order, lead=0.005, cycle_start=None, reverse=False, sweep_durs=None,
+            dark=False, timeout=2.0):
+        if cycle_start is None:
+            cycle_start = monotonic() + lead
+        timeline = make_timeline(display_durs, inter_durs, order, cycle_start)
+        for k, onset, dur in timeline:
+            self.ctrl[k, CTRL_ONSET] = onset
+            self.ctrl[k, CTRL_DUR] = dur if sweep_durs is None else sweep_durs[k] / 1000.0
+            self.ctrl[k, CTRL_REVERSE] = 1 if reverse else 0
+            self.ctrl[k, CTRL_DARK] = 1 if dark else 0
+            self.done[k].clear()
+        for k, onset, dur in timeline:
+            self.go[k].set()
+        for k, onset, dur in timeline:
+            self._wait_done(k, onset + self.ctrl[k, CTRL_DUR] + timeout)
+        pres_durs, n_shows, inter_frame_time, onset_errors = [], [], [], []
+        self.last_onsets = []
+        for k, onset, dur in timeline:
+            self.last_onsets.append(float(self.results[k, RES_ONSET]))
+            pres_durs.append(round(float(self.results[k, RES_PRES_DUR])*1000, 2))
+            n_shows.append(int(self.results[k, RES_N_SHOWS]))
+            inter_frame_time.append(round(float(self.results[k, RES_INTER_FRAME])*1000, 2))
+            onset_errors.append(round(float(self.results[k, RES_ONSET_ERR])*1000, 3))
+        # wait for the gap after the last presentation
+        last_k, last_onset, last_dur = timeline[-1]
+        sleep_until(last_onset + last_dur + inter_durs[last_k] / 1000.0)
+        return pres_durs, n_shows, inter_frame_time, onset_errors
+
+    # Wait until worker k is done with its sweep, at most until deadline
+    # (monotonic clock)
+    def _wait_done(self, k, deadline):
+        while not self.done[k].wait(0.05):
+            if not self.workers[k].is_alive():
+                raise RuntimeError('Strip worker ' + str(k+1) + ' died (exit code ' + str(self.workers[k].exitcode) + ')')
+            if monotonic() > deadline:
+                raise RuntimeError('Strip worker ' + str(k+1) + ' did not finish its sweep')
+
+    def stop(self, timeout=2.0):
+        for k in range(self.n_strips):
+            self.ctrl[k, CTRL_STOP] = 1
+            self.go[k].set()
+        for worker in self.workers:
+            worker.join(timeout)
+            if worker.is_alive():
+                worker.terminate()
@@ -0,0 +1,199 @@
+#!/usr/bin/python
+
+# --------------------------------------------------------------------------
+# Outbound sync events for aligning presentations with eye-tracking data or
+# a photodiode: one onset and one offset event for every presentation of
+# every strip, sent while the sweep is running.
+#
+# - onset:  right after the first show() with image data
+# - offset: right after the show() that follows clear() at the end
+# Each event carries the monotonic timestamp taken when that show returned.
+# Outputs (either or both):
+# - a TTL level per strip on a GPIO pin (BCM numbering), high from onset to
+#   offset
+# - a UDP datagram 'PV,<node>,<onset|offset>,<strip>,<presentation>,<time>'
+#   on a non-blocking socket; if it cannot be sent right away it is dropped
+#   and counted, so sending never blocks the sweep
+#
+# EventStrip wraps a strip object and detects onset and offset from the
+# calls the presentation loops already make, so it works with every
+# run_paint variant. Between onset and clear() its show is the strip's own
+# show method, so the sweep itself pays nothing.
+#
+# Benchmark the added latency against a local UDP receiver:
+#   python sync_events.py [n_presentations]
+# --------------------------------------------------------------------------
+
+import sys
+import time
+import socket
+import multiprocessing
+from monotonic_clock import monotonic
+try:
+    import RPi.GPIO as GPIO
+except ImportError: # not on a Pi: UDP events only
+    GPIO = None
+
+ONSET, OFFSET = 'onset', 'offset'
+
+
+class SyncEvents(object):
+    # udp_target: (host, port) or None, ttl_pins: GPIO pin per strip or None
+    def __init__(self, udp_target=None, ttl_pins=None, node_name=None):
+        self.node_name = node_name or socket.gethostname()
+        self.ttl_pins = ttl_pins or []
+        self.sent = 0
+        self.dropped = 0 # datagrams that could not be sent without blocking
+        self._sock = None
+        if udp_target is not None:
+            self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self._sock.connect(udp_target) # resolve the address once
+            self._sock.setblocking(False)
+        if self.ttl_pins:
+            if GPIO is None:
+                raise RuntimeError('TTL sync events need RPi.GPIO')
+            GPIO.setwarnings(False)
+            GPIO.setmode(GPIO.BCM)
+            for pin in self.ttl_pins:
+                GPIO.setup(pin, GPIO.OUT, initial=GPIO.LOW)
+
+    def emit(self, kind, strip, presentation, timestamp):
+        if strip < len(self.ttl_pins): # TTL first, it is the faster output
+            GPIO.output(self.ttl_pins[strip], kind == ONSET)
+        if self._sock is not None:
+            message = 'PV,%s,%s,%d,%d,%.6f' % (self.node_name, kind, strip+1, presentation, timestamp)
+            try:
+                self._sock.send(message.encode('ascii'))
+                self.sent += 1
+            except socket.error: # buffer full or no receiver: never wait
+                self.dropped += 1
+
+    def close(self):
+        for pin in self.ttl_pins:
+            GPIO.output(pin, False)
+        if self.ttl_pins:
+            GPIO.cleanup(self.ttl_pins) # only our pins, the strips keep theirs
+        if self._sock is not None:
+            self._sock.close()
+
+
+class EventStrip(object):
+    def __init__(self, strip, events, k):
+        self._strip = strip
+        self._events = events
+        self._k = k
+        self.presentation = 0    # number of presentations so far
+        self.onset_time = None   # monotonic time of the last onset
+        self.lit = False
+        self.show = self._show_armed
+
+    # setPixelColor, setBrightness, ... go straight to the strip
+    def __getattr__(self, name):
+        return getattr(self._strip, name)
+
+    # first show of a presentation: emit the onset, then step aside
+    def _show_armed(self, *args):
+        self._strip.show(*args)
+        if args and not self.lit: # image data (bare show()s are the loading colors)
+            timestamp = monotonic()
+            self.lit = True
+            self.show = self._strip.show
+            self.presentation += 1
+            self.onset_time = timestamp
+            self._events.emit(ONSET, self._k, self.presentation, timestamp)
+
+    def clear(self):
+        self._strip.clear()
+        if self.lit:
+            self.show = self._show_cleared
+
+    # show after clear(): the strip went dark, emit the offset
+    def _show_cleared(self, *args):
+        self._strip.show(*args)
+        if args: # new image data after all, still the same presentation
+            self.show = self._strip.show
+            return
+        timestamp = monotonic()
+        self.lit = False
+        self.show = self._show_armed
+        self._events.emit(OFFSET, self._k, self.presentation, timestamp)
+
+
+# The strip behind an EventStrip (for output that is no presentation)
+def bare_strip(strip):
+    return strip._strip if isinstance(strip, EventStrip) else strip
+
+
+# Wrap all strips (k = strip index)
+def wrap_strips(strips, events):
+    return [EventStrip(strips[k], events, k) for k in range(len(strips))]
+
+
+# 'host:port' -> (host, port)
+def parse_target(target):
+    host, _, port = target.rpartition(':')
+    return host, int(port)
+
+
+def _percentiles(values, ps=(50, 90, 99, 100)):
+    values = sorted(values)
+    if not values:
+        return [0.0 for p in ps]
+    return [round(values[min(len(values)-1, int(p / 100.0 * len(values)))] * 1e6, 1) for p in ps]
+
+
+if __name__ == '__main__':
+    # stand-ins for a strip and for the eye-tracker host
+    class NullStrip(object):
+        def show(self, *args):
+            pass
+
+        def clear(self):
+            pass
+
+    # the receiver runs in its own process, like the eye-tracker host would
+    def receive(receiver, results):
+        delivery = []
+        while True:
+            data = receiver.recv(256).decode('ascii')
+            received = monotonic()
+            if data == 'END':
+                break
+            delivery.append(received - float(data.split(',')[-1]))
+        results.send(delivery)
+
+    n_presentations = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    n_columns = 45
+    column = bytearray(144 * 4)
+    receiver = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    receiver.bind(('127.0.0.1', 0))
+    results, child_results = multiprocessing.Pipe()
+    process = multiprocessing.Process(target=receive, args=(receiver, child_results))
+    process.daemon = True
+    process.start()
+
+    def presentation_times(strip):
+        times = []
+        for n in range(n_presentations):
+            startTime = monotonic()
+            for c in range(n_columns):
+                strip.show(column)
+            strip.clear()
+            strip.show()
+            times.append(monotonic() - startTime)
+            time.sleep(0.001) # inter_durs gap
+        return times
+
+    plain = presentation_times(NullStrip())
+    events = SyncEvents(receiver.getsockname(), node_name='bench')
+    with_events = presentation_times(EventStrip(NullStrip(), events, 0))
+    added = [with_events[n] - plain[n] for n in range(n_presentations)]
+    print('Presentation time without events, percentiles [50, 90, 99, 100] [us]: ' + str(_percentiles(plain)))
+    print('Presentation time with events,    percentiles [50, 90, 99, 100] [us]: ' + str(_percentiles(with_events)))
+    print('Added per presentation (onset + offset),       median [us]: ' + str(_percentiles(added)[0]))
+    time.sleep(0.2) # let the receiver drain its socket
+    events._sock.setblocking(True)
+    events._sock.send(b'END')
+    delivery = results.recv()
+    print('Show to receiver latency, percentiles [50, 90, 99, 100] [us]: ' + str(_percentiles(delivery)))
+    print('Sent ' + str(events.sent) + ', dropped ' + str(events.dropped) + ', received ' + str(len(delivery)))
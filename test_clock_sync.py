@@ -0,0 +1,57 @@
+# Tests of the clock offset and cycle schedule of synchronized devices:
+#   python -m pytest -q
+
+import socket
+import pytest
+from clock_sync import ClockSync, offset_and_delay
+
+
+def test_offset_and_delay_of_an_exchange():
+    # other clock 10 s ahead, 1 ms each way, 0.5 ms to reply
+    offset, delay = offset_and_delay(100.0, 110.001, 110.0015, 100.0025)
+    assert offset == pytest.approx(10.0)
+    assert delay == pytest.approx(0.002)
+
+
+def test_asymmetric_paths_bias_the_offset_by_half_the_difference():
+    offset, delay = offset_and_delay(0.0, 0.003, 0.003, 0.004) # 3 ms there, 1 ms back
+    assert offset == pytest.approx(0.001)
+    assert delay == pytest.approx(0.004)
+
+
+def make_follower(offset=0.0, epoch=100.0, period=0.25, now=100.0):
+    sync = ClockSync('follower', period=period)
+    sync.offset, sync.epoch = offset, epoch
+    sync.now = lambda: now
+    return sync
+
+
+def test_next_cycle_is_the_next_scheduled_onset():
+    assert make_follower(now=100.3).next_cycle() == (2, pytest.approx(100.5))
+
+
+def test_next_cycle_keeps_the_lead():
+    assert make_follower(now=100.499).next_cycle(min_lead=0.002) == (3, pytest.approx(100.75))
+
+
+def test_next_cycle_on_the_local_clock():
+    # local clock 0.037 s ahead of the master: onsets come 0.037 s later locally
+    cycle, onset = make_follower(offset=-0.037, now=100.337).next_cycle()
+    assert cycle == 2 and onset == pytest.approx(100.537)
+
+
+def test_before_the_epoch_starts_at_cycle_zero():
+    assert make_follower(now=99.0).next_cycle() == (0, pytest.approx(100.0))
+
+
+def test_follower_syncs_despite_junk_datagrams():
+    master = ClockSync('master', port=0)
+    port = master._sock.getsockname()[1]
+    master.start()
+    junk = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    for datagram in [b'PV,onset,1,0.5', b'\xff\xfe', b'[1, 2]', b'{"type": "sync"}']:
+        junk.sendto(datagram, ('127.0.0.1', port))
+    follower = ClockSync('follower', '127.0.0.1', port, clock_offset=0.037, sync_interval=0.01)
+    follower.start(timeout=5.0)
+    assert follower.offset == pytest.approx(-0.037, abs=0.005)
+    assert follower.epoch == master.epoch
@@ -0,0 +1,29 @@
+# Tests of the closed-loop duration control:
+#   python -m pytest -q
+
+import pytest
+from duration_control import DurationController
+
+
+def test_trim_converges_to_the_overshoot():
+    controller = DurationController(1, gain=0.2)
+    dur, overshoot = 0.02, 0.003
+    for i in range(100):
+        controller.update(0, dur, controller.sweep_dur(0, dur) + overshoot)
+    assert controller.trims[0] == pytest.approx(overshoot, abs=1e-6)
+    assert controller.errors[0][-1] == pytest.approx(0.0, abs=1e-6) # settled
+    assert controller.residual_stats(0)[0] > 0.0 # the mean includes the first, uncompensated sweeps
+    assert controller.sweep_dur(0, dur) == pytest.approx(dur - overshoot)
+
+
+def test_trim_is_capped_at_half_the_duration():
+    controller = DurationController(2)
+    assert controller.calibrate(1, lambda dur: dur + 1.0, 0.02, n_sweeps=5) == pytest.approx(0.01)
+    assert controller.sweep_dur(1, 0.02) == pytest.approx(0.01)
+    assert controller.trims[0] == 0.0 # other strips are untouched
+
+
+def test_calibration_takes_the_median_overshoot():
+    overshoots = iter([0.001, 0.005, 0.002, 0.1, 0.002])
+    controller = DurationController(1)
+    assert controller.calibrate(0, lambda dur: dur + next(overshoots), 0.02, n_sweeps=5) == pytest.approx(0.002)
@@ -0,0 +1,109 @@
+# Tests of frame banks and delta writes:
+#   python -m pytest -q
+
+import numpy as np
+import frame_bank
+from frame_bank import lit_extents, make_frame_bank, shared_frame_bank, run_paint_bank, delta_column, FrameBank
+
+N_LEDS = 8
+
+
+# Records the payload of every show() instead of sending it
+class RecordingStrip(object):
+    def __init__(self):
+        self.payloads = []
+        self.n_clears = 0
+
+    def show(self, *args):
+        self.payloads.append(bytes(bytearray(args[0])) if args else None)
+
+    def clear(self):
+        self.n_clears += 1
+
+
+# Column c lights the first c+1 LEDs in green
+class StairsPaint(object):
+    def __init__(self, n_cols):
+        self.n_cols = n_cols
+
+    def dither(self, buf, position):
+        column = int(round(position * (self.n_cols - 1)))
+        data = np.frombuffer(buf, dtype=np.uint8)
+        data[:] = 0
+        data[0::4] = 0xFF
+        data[2:4 * (column + 1):4] = 100
+
+
+def stairs_bank(n_cols=4):
+    return make_frame_bank(StairsPaint(n_cols), bytearray(N_LEDS * 4), n_cols)
+
+
+def test_lit_extents():
+    bank = np.zeros((3, N_LEDS * 4), dtype=np.uint8)
+    bank[:, 0::4] = 0xFF # headers alone are not lit
+    bank[1, 4 * 2 + 1] = 1 # LED 3
+    bank[2, 4 * 7 + 3] = 1 # last LED
+    assert lit_extents(bank) == [0, 3, 8]
+
+
+def test_lit_extents_of_phases_take_any_phase():
+    bank = np.zeros((2, 2, N_LEDS * 4), dtype=np.uint8)
+    bank[1, 0, 4 * 4 + 2] = 1
+    assert lit_extents(bank) == [5, 0]
+
+
+def test_banks_carry_their_extents():
+    bank = stairs_bank()
+    assert isinstance(bank, FrameBank)
+    assert bank.extents == [1, 2, 3, 4]
+    shared = shared_frame_bank(bank)
+    assert shared.extents == [1, 2, 3, 4]
+    assert bank[::-1].extents is None # views do not
+
+
+def test_sweep_sends_up_to_the_last_changing_led():
+    bank = stairs_bank()
+    strip = RecordingStrip()
+    run_paint_bank(0.02, 0, bank, strip)
+    shown = [p for p in strip.payloads if p is not None]
+    assert shown
+    for payload in shown:
+        n_sent = len(payload) // 4
+        lit = payload[2::4].count(b'\x64')
+        assert n_sent >= lit # never cut before a lit LED
+        assert payload == bytes(bytearray(bank[lit - 1, 0:len(payload)]))
+    assert strip.payloads[-1] is None and strip.n_clears == 1
+
+
+def test_reversed_sweep_falls_back_to_earlier_extents():
+    bank = stairs_bank()
+    strip = RecordingStrip()
+    run_paint_bank(0.02, 0, bank, strip, reverse=True)
+    shown = [p for p in strip.payloads if p is not None]
+    assert len(shown[0]) == 4 * 4 # starts with the last column
+    # the strip still shows the longer column before: it must be overwritten
+    lengths = [len(p) // 4 for p in shown]
+    lits = [p[2::4].count(b'\x64') for p in shown]
+    for i in range(1, len(shown)):
+        assert lengths[i] >= max(lits[i], lits[i-1])
+
+
+def test_full_columns_without_delta_writes(monkeypatch):
+    monkeypatch.setattr(frame_bank, 'delta_writes', False)
+    strip = RecordingStrip()
+    run_paint_bank(0.01, 0, stairs_bank(), strip)
+    assert set(len(p) for p in strip.payloads if p is not None) == set([N_LEDS * 4])
+
+
+def test_delta_column_matches_lit_extents():
+    bank = stairs_bank()
+    lit = 0
+    for c in range(4):
+        leds = np.frombuffer(bytearray(bank[c]), dtype=np.uint8)
+        column, extent = delta_column(leds, lit)
+        assert extent == bank.extents[c]
+        assert len(column) == 4 * max(extent, lit, 1)
+        lit = extent
+    dark = np.frombuffer(bytearray(b'\xff\x00\x00\x00' * N_LEDS), dtype=np.uint8)
+    column, extent = delta_column(dark, 3)
+    assert extent == 0 and len(column) == 4 * 3 # clears what the column before lit
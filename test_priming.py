@@ -0,0 +1,82 @@
+# Tests of priming (dark sweeps until the show cost settles):
+#   python -m pytest -q
+
+import numpy as np
+import pytest
+from frame_bank import make_frame_bank
+from priming import DarkStrip, prime, show_cost
+
+N_LEDS = 8
+
+
+# Records the payload of every show() instead of sending it
+class RecordingStrip(object):
+    def __init__(self):
+        self.payloads = []
+        self.n_clears = 0
+
+    def show(self, *args):
+        self.payloads.append(bytes(bytearray(args[0])) if args else None)
+
+    def clear(self):
+        self.n_clears += 1
+
+
+# Column c lights the first c+1 LEDs in green
+class StairsPaint(object):
+    def __init__(self, n_cols):
+        self.n_cols = n_cols
+
+    def dither(self, buf, position):
+        column = int(round(position * (self.n_cols - 1)))
+        data = np.frombuffer(buf, dtype=np.uint8)
+        data[:] = 0
+        data[0::4] = 0xFF
+        data[2:4 * (column + 1):4] = 100
+
+
+def stairs_bank(n_cols=4):
+    return make_frame_bank(StairsPaint(n_cols), bytearray(N_LEDS * 4), n_cols)
+
+
+def test_show_cost_excludes_the_clear():
+    assert show_cost([0.001, 0.002, 0.003, 0.010]) == pytest.approx(0.001)
+
+
+def test_prime_runs_until_the_cost_settles():
+    costs = iter([0.01 * 0.5 ** n + 0.001 for n in range(1000)])
+    n_rounds, elapsed, settled, first, final = prime(lambda: [next(costs)], tolerance=0.02, window=3, max_time=10.0)
+    assert settled
+    assert first == [pytest.approx(0.011)]
+    assert final[0] == pytest.approx(0.001, rel=0.05)
+    assert n_rounds < 20
+
+
+def test_prime_ignores_single_slow_rounds():
+    costs = iter([0.001, 0.001, 0.005, 0.001, 0.001, 0.001] * 10)
+    n_rounds, elapsed, settled, first, final = prime(lambda: [next(costs)], tolerance=0.02, window=3, max_time=10.0)
+    assert settled and n_rounds == 6
+
+
+def test_prime_stops_at_the_time_limit():
+    rounds = [0]
+
+    def alternating():
+        rounds[0] += 1
+        return [0.001 * (1 + rounds[0] % 2)] # the medians of odd windows alternate too
+    n_rounds, elapsed, settled, first, final = prime(alternating, max_time=0.05)
+    assert not settled
+    assert 0.05 <= elapsed < 1.0
+
+
+def test_dark_strip_sends_the_same_length_without_color():
+    strip = RecordingStrip()
+    dark = DarkStrip(strip)
+    column = stairs_bank()[3]
+    dark.show(column)
+    dark.show(bytearray(b'\xff\x01\x02\x03' * 2))
+    dark.show()
+    assert strip.payloads[0] == b'\xff\x00\x00\x00' * N_LEDS
+    assert strip.payloads[1] == b'\xff\x00\x00\x00' * 2
+    assert strip.payloads[2] is None
+    assert column[2] == 100 # the bank itself is untouched
@@ -0,0 +1,97 @@
+# Tests of procedural stimuli (specs, generators and their cache):
+#   python -m pytest -q
+
+import numpy as np
+import pytest
+import procedural_stimuli
+from procedural_stimuli import parse_spec, make_procedural_bank, to_frame_bank
+
+N_LEDS = 6
+LINEAR = (1.0, 1.0, 1.0)
+FULL = (255, 255, 255)
+
+
+def make_bank(spec, **kwargs):
+    return make_procedural_bank(spec, N_LEDS, 'rgb', LINEAR, FULL, False, **kwargs)
+
+
+def test_parse_spec():
+    assert parse_spec('gen:bars?columns=10,30&bar_width=2') == ('bars', {'columns': (10.0, 30.0), 'bar_width': 2.0})
+    assert parse_spec('gen:grating?wave=square&cycles=2') == ('grating', {'wave': 'square', 'cycles': 2.0})
+    assert parse_spec('gen:noise') == ('noise', {})
+
+
+def test_unknown_kind():
+    with pytest.raises(ValueError):
+        make_bank('gen:checkerboard')
+
+
+def test_bars_light_their_columns_in_strip_order():
+    bank = make_bank('gen:bars?width=5&columns=1,3&color=0,255,0')
+    assert bank.shape == (5, N_LEDS * 4)
+    lit = bank.reshape(5, N_LEDS, 4)
+    assert list(lit[:, 0, 2]) == [0, 255, 0, 255, 0] # G is the second byte after the header in 'rgb' order
+    assert (lit[..., 0] == 0xFF).all() and not lit[..., 1].any() and not lit[..., 3].any()
+    assert bank.extents == [0, N_LEDS, 0, N_LEDS, 0]
+
+
+def test_color_order_and_vflip():
+    image = np.zeros((1, N_LEDS, 3))
+    image[0, 0] = (1.0, 0.0, 0.0) # red on the first LED
+    bank = to_frame_bank(image, FULL, 'bgr', LINEAR, FULL, True).reshape(N_LEDS, 4)
+    assert list(bank[N_LEDS - 1]) == [0xFF, 0, 0, 255] # last LED after vflip, red in the last byte
+
+
+def test_vertical_grating_varies_across_columns():
+    bank = make_bank('gen:grating?width=8&cycles=1').reshape(8, N_LEDS, 4)
+    assert (bank[:, :, 1] == bank[:, :1, 1]).all() # the same along the strip
+    assert bank[:, 0, 1].max() > 200 and bank[:, 0, 1].min() < 50
+
+
+def test_specs_are_cached_but_fresh_noise_is_not():
+    assert make_bank('gen:bars?columns=2') is make_bank('gen:bars?columns=2')
+    assert make_bank('gen:noise?seed=3') is make_bank('gen:noise?seed=3')
+    first, second = make_bank('gen:noise'), make_bank('gen:noise')
+    assert first is not second and not np.array_equal(first, second)
+
+
+def test_cache_is_bounded(monkeypatch):
+    monkeypatch.setattr(procedural_stimuli, 'max_cached', 2)
+    monkeypatch.setattr(procedural_stimuli, '_cache', procedural_stimuli.collections.OrderedDict())
+    first = make_bank('gen:bars?columns=1')
+    make_bank('gen:bars?columns=2')
+    make_bank('gen:bars?columns=1') # most recently used again
+    make_bank('gen:bars?columns=3')
+    assert make_bank('gen:bars?columns=1') is first
+    assert len(procedural_stimuli._cache) == 2
+
+
+# Temporally dithered phases (n_phases > 1)
+
+def test_phases_average_to_the_gamma_corrected_target():
+    image = np.linspace(0.0, 1.0, 7)[:, np.newaxis] * np.ones((1, N_LEDS))
+    color_balance = (40, 40, 40) # few levels: the case phases are for
+    for n_phases in (2, 4):
+        bank = to_frame_bank(image, FULL, 'rgb', (2.0, 2.0, 2.0), color_balance, False, n_phases)
+        assert bank.shape == (n_phases, 7, N_LEDS * 4)
+        mean = bank.reshape(n_phases, 7, N_LEDS, 4)[..., 1].mean(axis=0)
+        target = np.power(image, 2.0) * 40
+        assert np.abs(mean - target).max() <= 0.5 / n_phases + 1e-9
+
+
+def test_phases_step_up_on_different_leds():
+    image = np.full((1, N_LEDS), 0.5)
+    bank = to_frame_bank(image, FULL, 'rgb', LINEAR, (3, 3, 3), False, 2).reshape(2, N_LEDS, 4)[..., 1]
+    assert list(bank[0]) != list(bank[1]) # 1.5 alternates between 1 and 2 ...
+    assert not (bank[0] == bank[0, 0]).all() # ... but not on all LEDs at once
+    assert (bank.sum(axis=0) == 3).all()
+
+
+def test_phases_keep_the_header_and_full_levels():
+    bank = to_frame_bank(np.ones((2, N_LEDS)), FULL, 'rgb', LINEAR, FULL, False, 4).reshape(4, 2, N_LEDS, 4)
+    assert (bank[..., 0] == 0xFF).all() and (bank[..., 1:] == 255).all()
+
+
+def test_phased_specs_are_cached_per_phase_count():
+    assert make_bank('gen:bars?columns=1', n_phases=2) is not make_bank('gen:bars?columns=1')
+    assert make_bank('gen:bars?columns=1', n_phases=2).shape[0] == 2
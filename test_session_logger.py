@@ -0,0 +1,30 @@
+# Tests of the session log (write and read back):
+#   python -m pytest -q
+
+import os
+from session_logger import SessionLogger, load_session
+
+
+def test_session_log_roundtrip(tmp_path):
+    filename = str(tmp_path / 'session.pvlog')
+    logger = SessionLogger(filename, batch_size=2)
+    names = ['HER.png', u'caf\xe9.png', 'gen:bars?width=10']
+    for n, name in enumerate(names):
+        logger.log(n, 3, n % 2, name, 20.0, 5.0, 255, 1, 20.5, 40 + n, 1000.0 + n)
+    logger.close()
+    session = load_session(filename)
+    assert list(session['iteration']) == [0, 1, 2]
+    assert [f.decode('utf-8') for f in session['file_name']] == names
+    assert list(session['n_shows']) == [40, 41, 42]
+    assert session['onset'][2] == 1002.0
+
+
+def test_session_log_ignores_a_cut_block(tmp_path):
+    filename = str(tmp_path / 'session.pvlog')
+    logger = SessionLogger(filename, batch_size=1)
+    logger.log(0, 0, 0, 'A.png', 20.0, 5.0, 255, 1, 20.5, 40, 1.0)
+    logger.log(1, 0, 0, 'B.png', 20.0, 5.0, 255, 1, 20.5, 40, 2.0)
+    logger.close()
+    with open(filename, 'rb+') as f:
+        f.truncate(os.path.getsize(filename) - 3) # power loss during the last write
+    assert list(load_session(filename)['iteration']) == [0]
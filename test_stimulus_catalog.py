@@ -0,0 +1,81 @@
+# Tests of the stimulus catalog (index and image sets):
+#   python -m pytest -q
+
+import os
+import json
+import pytest
+from PIL import Image
+from stimulus_catalog import StimulusCatalog
+from stimulus_registry import StimulusRegistry
+
+N_LEDS = 4
+
+
+def make_catalog(tmp_path, sets):
+    image_path = tmp_path / 'stimuli'
+    image_path.mkdir()
+    Image.new('RGB', (10, N_LEDS), (255, 0, 0)).save(str(image_path / 'red.png'))
+    Image.new('RGB', (20, 8), (0, 0, 255)).save(str(image_path / 'tall.png'))
+    (image_path / 'broken.png').write_bytes(b'not an image')
+    sets_file = tmp_path / 'sets.json'
+    sets_file.write_text(json.dumps({'sets': [{'name': name, 'files': files} for name, files in sets]}))
+    return StimulusCatalog(str(image_path), str(sets_file), N_LEDS, (1.0, 1.0, 1.0), (1.0, 1.0, 1.0),
+        cache_path=str(tmp_path / 'cache'))
+
+
+def test_index_records_every_image(tmp_path):
+    catalog = make_catalog(tmp_path, [('a', ['red.png'])])
+    catalog.build()
+    assert catalog.stimuli['red.png']['status'] == 'image'
+    assert catalog.stimuli['tall.png']['status'] == 'resize'
+    assert catalog.stimuli['broken.png']['status'] == 'unreadable'
+    assert (catalog.stimuli['red.png']['width'], catalog.stimuli['red.png']['height']) == (10, N_LEDS)
+
+
+def test_index_is_kept_outside_the_stimuli(tmp_path):
+    catalog = make_catalog(tmp_path, [('a', ['red.png'])])
+    catalog.build()
+    assert sorted(os.listdir(catalog.image_path)) == ['broken.png', 'red.png', 'tall.png']
+    assert os.path.dirname(catalog.index_file) == str(tmp_path / 'cache')
+    assert os.path.exists(catalog.index_file)
+
+
+def test_sets_with_missing_or_unreadable_files_are_refused_when_selected(tmp_path, capsys):
+    catalog = make_catalog(tmp_path, [('good', ['red.png', 'gen:bars?width=10']), ('missing', ['red.png', 'gone.png']),
+        ('broken', ['broken.png', 'red.png'])])
+    catalog.build(set_size=2)
+    assert 'cannot be shown' in capsys.readouterr().out
+    assert sorted(catalog.problems) == ['broken', 'missing']
+    assert catalog.index_of('good') == 0
+    with pytest.raises(ValueError):
+        catalog.index_of('missing')
+    with pytest.raises(ValueError):
+        catalog.index_of('broken')
+
+
+def test_sets_of_the_wrong_size_are_an_error(tmp_path):
+    catalog = make_catalog(tmp_path, [('a', ['red.png']), ('a', ['red.png', 'red.png'])])
+    with pytest.raises(ValueError) as error:
+        catalog.build(set_size=2)
+    assert 'defined twice' in str(error.value) and 'needs 2' in str(error.value)
+
+
+def test_added_sets_are_checked(tmp_path):
+    catalog = make_catalog(tmp_path, [('a', ['red.png'])])
+    catalog.build()
+    catalog.add_set('usb', [str(tmp_path / 'stimuli' / 'red.png')]) # absolute paths are allowed
+    catalog.add_set('usb-gone', [str(tmp_path / 'gone.png')])
+    assert catalog.index_of('usb') == 1
+    with pytest.raises(ValueError):
+        catalog.index_of('usb-gone')
+
+
+def test_registry_takes_the_hash_from_the_catalog(tmp_path):
+    catalog = make_catalog(tmp_path, [('a', ['red.png'])])
+    catalog.build()
+    registry = StimulusRegistry(catalog.image_path, catalog)
+    assert registry.content_hash('red.png') == catalog.stimuli['red.png']['hash']
+    assert registry._hashes == {} # not hashed again
+    Image.new('RGB', (12, N_LEDS)).save(os.path.join(catalog.image_path, 'red.png'))
+    assert catalog.content_hash('red.png') is None # changed since indexing
+    assert registry.content_hash('red.png') != catalog.stimuli['red.png']['hash']
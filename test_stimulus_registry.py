@@ -0,0 +1,73 @@
+# Tests of the reference-counted stimulus registry:
+#   python -m pytest -q
+
+import numpy as np
+from stimulus_registry import StimulusRegistry
+
+PARAMS = (144, 255)
+
+
+class Loader(object):
+    def __init__(self):
+        self.n_loads = 0
+
+    def __call__(self):
+        self.n_loads += 1
+        return 'lightpaint-' + str(self.n_loads), 10
+
+
+def make_registry(tmp_path):
+    (tmp_path / 'a.png').write_bytes(b'same content')
+    (tmp_path / 'copy of a.png').write_bytes(b'same content')
+    (tmp_path / 'b.png').write_bytes(b'other content')
+    return StimulusRegistry(str(tmp_path))
+
+
+def test_identical_files_are_processed_once(tmp_path):
+    registry, load = make_registry(tmp_path), Loader()
+    first = registry.acquire('a.png', PARAMS, load)
+    second = registry.acquire('copy of a.png', PARAMS, load)
+    assert load.n_loads == 1
+    assert first == second # same lightpaint, width and key
+    registry.acquire('b.png', PARAMS, load)
+    registry.acquire('a.png', (72, 255), load) # other processing
+    assert load.n_loads == 3 and len(registry) == 3
+
+
+def test_entries_live_until_the_last_release(tmp_path):
+    registry, load = make_registry(tmp_path), Loader()
+    key = registry.acquire('a.png', PARAMS, load)[2]
+    registry.acquire('a.png', PARAMS, load)
+    registry.release(key)
+    assert len(registry) == 1
+    registry.release(key)
+    assert len(registry) == 0
+    registry.release(key) # already gone: ignored
+    registry.acquire('a.png', PARAMS, load)
+    assert load.n_loads == 2 # loaded again after it was dropped
+
+
+def test_release_all(tmp_path):
+    registry, load = make_registry(tmp_path), Loader()
+    keys = [registry.acquire(name, PARAMS, load)[2] for name in ['a.png', 'b.png', 'copy of a.png']]
+    registry.release_all(keys)
+    assert len(registry) == 0
+
+
+def test_changed_files_are_hashed_again(tmp_path):
+    registry, load = make_registry(tmp_path), Loader()
+    key = registry.acquire('b.png', PARAMS, load)[2]
+    (tmp_path / 'b.png').write_bytes(b'new content, other size')
+    assert registry.acquire('b.png', PARAMS, load)[2] != key
+    assert load.n_loads == 2
+
+
+def test_frame_banks_are_shared_and_rebuilt_for_other_phases(tmp_path):
+    class Paint(object):
+        def dither(self, buf, position):
+            np.frombuffer(buf, dtype=np.uint8)[:] = 0xFF
+    registry = StimulusRegistry(str(make_registry(tmp_path).image_path))
+    key = registry.acquire('a.png', PARAMS, lambda: (Paint(), 3))[2]
+    bank = registry.frame_bank(key, bytearray(8))
+    assert registry.frame_bank(key, bytearray(8)) is bank
+    assert registry.frame_bank(key, bytearray(8), n_phases=2).shape == (2, 3, 8)
@@ -0,0 +1,59 @@
+# Tests of the tile read-ahead of streamed wide images:
+#   python -m pytest -q
+
+import gc
+import threading
+import numpy as np
+from PIL import Image
+from streaming_columns import ColumnStream, UNLIMITED_POWER
+from stimulus_registry import StimulusRegistry
+
+N_LEDS = 4
+
+
+# LightPaint stand-in: every column shows its position
+class FakePaint(object):
+    def __init__(self, pixels, size, color_balance):
+        self.size = size
+
+    def dither(self, buf, position):
+        data = np.frombuffer(buf, dtype=np.uint8)
+        data[:] = 0xFF
+        data[1::4] = int(round(position * 100))
+
+
+def make_stream(tmp_path, width=1000, tile_cols=100, n_resident=4):
+    path = str(tmp_path / 'wide.png')
+    Image.new('RGB', (width, N_LEDS), (10, 20, 30)).save(path)
+    power = ((1.0, 1.0, 1.0), (255, 255, 255), UNLIMITED_POWER)
+    return ColumnStream(path, N_LEDS, FakePaint, power, tile_cols, n_resident, str(tmp_path / 'cache'))
+
+
+def test_upcoming_tiles_follow_the_stride(tmp_path):
+    stream = make_stream(tmp_path)
+    assert stream.upcoming_tiles(0, 1.0) == [0, 1, 2]
+    assert stream.upcoming_tiles(0, 150.0) == [0, 1, 3] # columns 0, 150, 300: tile 2 is skipped
+    assert stream.upcoming_tiles(999, -1.0) == [9, 8, 7]
+    assert stream.upcoming_tiles(950, 100.0) == [9] # nothing past the last column
+    stream.close()
+
+
+def test_first_and_last_tiles_are_ready_before_any_sweep(tmp_path):
+    stream = make_stream(tmp_path)
+    stream.column(0)
+    stream.column(999)
+    assert stream.misses == 0
+    stream.close()
+
+
+def test_released_streams_are_freed(tmp_path):
+    make_stream(tmp_path).close() # writes wide.png
+    registry = StimulusRegistry(str(tmp_path))
+    n_threads = threading.active_count()
+    for i in range(5):
+        stream, width, key = registry.acquire('wide.png', ('stream', i), lambda: (make_stream(tmp_path), 1000))
+        registry.release(key)
+    del stream # the last one
+    gc.collect()
+    assert threading.active_count() == n_threads
+    assert not [o for o in gc.get_objects() if isinstance(o, ColumnStream)]
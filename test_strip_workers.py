@@ -0,0 +1,80 @@
+# Tests of the strip workers (central timeline and worker processes):
+#   python -m pytest -q
+
+import time
+import numpy as np
+import pytest
+from frame_bank import indexed_bank
+from strip_workers import make_timeline, StripWorkerPool
+
+
+def test_timeline_follows_order_and_gaps():
+    timeline = make_timeline([10, 20, 30], [5, 0, 5], [2, 0, 1], 100.0)
+    assert [k for k, onset, dur in timeline] == [2, 0, 1]
+    assert [dur for k, onset, dur in timeline] == pytest.approx([0.03, 0.01, 0.02])
+    assert [onset for k, onset, dur in timeline] == pytest.approx([100.0, 100.035, 100.05])
+
+
+def test_timeline_negative_gap_overlaps_but_never_starts_early():
+    timeline = make_timeline([10, 10], [-15, 0], [0, 1], 1.0)
+    assert timeline[1][1] == pytest.approx(1.0) # clamped to the cycle start
+    timeline = make_timeline([10, 10], [-5, 0], [0, 1], 1.0)
+    assert timeline[1][1] == pytest.approx(1.005)
+
+
+class FakeStrip(object):
+    def show(self, *args):
+        pass
+
+    def clear(self):
+        pass
+
+
+class CrashingStrip(FakeStrip):
+    def show(self, *args):
+        raise IOError('SPI write failed')
+
+
+class HangingStrip(FakeStrip):
+    def show(self, *args):
+        time.sleep(60)
+
+
+def make_pool(strips):
+    bank = indexed_bank(np.full((4, 8 * 4), 0xFF, dtype=np.uint8))
+    pool = StripWorkerPool(strips, [bank] * len(strips), [0] * len(strips))
+    pool.start()
+    return pool
+
+
+def test_cycle_reports_every_strip_in_order():
+    pool = make_pool([FakeStrip(), FakeStrip()])
+    try:
+        pres_durs, n_shows, inter_frame_time, onset_errors = pool.run_cycle([20, 10], [5, 5], [1, 0])
+        assert pres_durs[0] == pytest.approx(10, abs=5) and pres_durs[1] == pytest.approx(20, abs=5)
+        assert min(n_shows) > 1
+        assert pool.last_onsets[1] - pool.last_onsets[0] == pytest.approx(0.015, abs=0.01)
+    finally:
+        pool.stop()
+
+
+def test_dead_worker_raises_instead_of_hanging():
+    pool = make_pool([FakeStrip(), CrashingStrip()])
+    try:
+        startTime = time.time()
+        with pytest.raises(RuntimeError) as error:
+            pool.run_cycle([10, 10], [0, 0], [0, 1], timeout=30.0)
+        assert 'died' in str(error.value)
+        assert time.time() - startTime < 5.0
+    finally:
+        pool.stop()
+
+
+def test_stuck_worker_raises_after_the_timeout():
+    pool = make_pool([HangingStrip()])
+    try:
+        with pytest.raises(RuntimeError) as error:
+            pool.run_cycle([10], [0], [0], timeout=0.2)
+        assert 'did not finish' in str(error.value)
+    finally:
+        pool.stop()
@@ -0,0 +1,55 @@
+# Tests of the show cost model and the coverage plan:
+#   python -m pytest -q
+
+import pytest
+from throughput_planner import StripCost, wire_bits, predict, min_duration, check_plan
+
+
+def test_wire_bits_of_hardware_spi():
+    assert wire_bits(144, True) == (4 + 4 * 144 + 9) * 8 # header, LEDs, footer of (144+15)/16 bytes
+    assert wire_bits(144, True, 16) == (4 + 4 * 16 + 1) * 8
+
+
+def test_wire_bits_of_bit_bang():
+    assert wire_bits(144, False) == (4 + 4 * 144) * 8 + 72
+
+
+def test_wire_bits_clamp_the_leds_sent():
+    assert wire_bits(144, True, 0) == wire_bits(144, True, 1)
+    assert wire_bits(144, True, 500) == wire_bits(144, True)
+
+
+# 1 ms per show of a full strip without dither
+def full_ms_cost(n_leds=144, dither=0.0):
+    return StripCost(n_leds, True, 0.0, 0.001 / wire_bits(n_leds, True), dither)
+
+
+def test_predict_shows_and_coverage():
+    assert predict(full_ms_cost(), 100, 200) == (101, pytest.approx(101 / 200.0))
+    assert predict(full_ms_cost(), 100, 50) == (101, 1.0)
+
+
+def test_fewer_leds_sent_give_more_shows():
+    n_shows, coverage = predict(full_ms_cost(), 100, 200, n_sent=36)
+    assert n_shows > 101 * 3 and coverage == 1.0
+
+
+def test_min_duration_includes_dither():
+    assert min_duration(full_ms_cost(), 200) == 200
+    assert min_duration(full_ms_cost(dither=0.001), 200) == 400
+
+
+def test_check_plan_warns_and_adapts(capsys):
+    costs = [full_ms_cost(), full_ms_cost()]
+    display_durs = [100, 300]
+    assert not check_plan(costs, display_durs, [200, 200], adapt=True, max_dur=250)
+    assert display_durs == [200, 300] # only the strip that skips columns, capped at max_dur
+    assert 'Strip 1' in capsys.readouterr().out
+    display_durs = [100, 300]
+    assert not check_plan(costs, display_durs, [200, 200], adapt=True, max_dur=150)
+    assert display_durs == [150, 300]
+
+
+def test_check_plan_with_sent_leds():
+    assert check_plan([full_ms_cost()], [100], [200], sent_leds=[36])
+    assert not check_plan([full_ms_cost()], [100], [200], sent_leds=[144])
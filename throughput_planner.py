@@ -0,0 +1,120 @@
+#!/usr/bin/python
+
+# --------------------------------------------------------------------------
+# Throughput planner: predicts how many 'shows' fit into a presentation and
+# which share of the image columns will actually be shown.
+#
+# A sweep shows column floor(elapsed / dur * width) after every show, so with
+# fewer shows than columns some columns are skipped. The cost of one show is
+# modeled as
+#   cost = dither + overhead + per_bit * wire_bits(n_leds, n_sent)
+# where wire_bits counts what dotstar.c actually sends for n_sent LEDs (a
+# show can be cut after the last LED that changes, see frame_bank.py): a 4
+# byte header, 4 bytes per LED and a footer of (n_sent+15)/16 bytes
+# (hardware SPI) or (n_sent+1)/2 clock pulses (bit-bang), as dotstar.c sizes
+# the footer to the LEDs sent. 'overhead' and 'per_bit' are
+# calibrated at startup by timing shows with two payload sizes on every
+# strip, 'dither' by timing LightPaint.dither().
+# --------------------------------------------------------------------------
+
+import math
+from monotonic_clock import monotonic
+
+
+# Number of clock cycles one show of n_sent LEDs (all if None) puts on the wire
+def wire_bits(n_leds, hardware_spi, n_sent=None):
+    if n_sent is not None:
+        n_leds = max(1, min(n_leds, n_sent))
+    if hardware_spi:
+        return (4 + 4 * n_leds + (n_leds + 15) // 16) * 8
+    return (4 + 4 * n_leds) * 8 + (n_leds + 1) // 2
+
+
+class StripCost(object):
+    def __init__(self, n_leds, hardware_spi, overhead, per_bit, dither):
+        self.n_leds = n_leds
+        self.hardware_spi = hardware_spi
+        self.overhead = overhead # [s] per show, independent of the payload
+        self.per_bit = per_bit   # [s] per clock cycle on the wire
+        self.dither = dither     # [s] per column preparation
+
+    # predicted time of one dither + show of n_sent LEDs (all if None) [s]
+    def show_cost(self, n_sent=None):
+        return self.dither + self.overhead + self.per_bit * wire_bits(self.n_leds, self.hardware_spi, n_sent)
+
+
+def _time_calls(function, n):
+    startTime = monotonic()
+    for i in range(n):
+        function()
+    return (monotonic() - startTime) / n
+
+
+# Calibrate one strip: show() with the full and a quarter payload, and dither()
+# (if a LightPaint object is given; frame banks are shown without dither).
+# The strip shows blank columns.
+def calibrate_strip(strip, n_leds, hardware_spi, lightpaint=None, n_shows=100):
+    full = bytearray(b'\xff\x00\x00\x00' * n_leds)
+    part = bytearray(b'\xff\x00\x00\x00' * max(1, n_leds // 4))
+    t_full = _time_calls(lambda: strip.show(full), n_shows)
+    t_part = _time_calls(lambda: strip.show(part), n_shows)
+    strip.clear()
+    strip.show()
+    # dotstar.c sizes the footer to the payload, so both frames are counted
+    # in full
+    bits = wire_bits(n_leds, hardware_spi) - wire_bits(n_leds, hardware_spi, len(part) // 4)
+    per_bit = max(0.0, (t_full - t_part) / bits)
+    overhead = max(0.0, t_full - per_bit * wire_bits(n_leds, hardware_spi))
+    dither = 0.0
+    if lightpaint is not None and hasattr(lightpaint, 'dither'):
+        buf = bytearray(n_leds * 4)
+        dither = _time_calls(lambda: lightpaint.dither(buf, 0.5), n_shows)
+    return StripCost(n_leds, hardware_spi, overhead, per_bit, dither)
+
+
+# Predicted shows per sweep and share of columns shown at least once
+# (n_sent: mean LEDs sent per show, all if None)
+def predict(cost, dur_ms, img_width, n_sent=None):
+    n_shows = int(dur_ms / 1000.0 / cost.show_cost(n_sent)) + 1
+    coverage = min(1.0, float(n_shows) / max(1, img_width))
+    return n_shows, coverage
+
+
+# Shortest duration [ms] at which every column of the image is shown
+def min_duration(cost, img_width, n_sent=None):
+    return int(math.ceil(img_width * cost.show_cost(n_sent) * 1000))
+
+
+# Check (and optionally adapt) the durations of the current image set.
+# Prints a warning for every strip that will skip columns. With adapt, the
+# display duration of those strips is raised in place (up to max_dur).
+# sent_leds: mean LEDs sent per show of every strip (all if None).
+def check_plan(costs, display_durs, img_widths, adapt=False, max_dur=None, sent_leds=None):
+    ok = True
+    for k in range(len(costs)):
+        n_sent = None if sent_leds is None else sent_leds[k]
+        n_shows, coverage = predict(costs[k], display_durs[k], img_widths[k], n_sent)
+        if coverage < 1.0:
+            ok = False
+            needed = min_duration(costs[k], img_widths[k], n_sent)
+            print('Warning! Strip ' + str(k+1) + ': ' + str(display_durs[k]) + ' ms for ' + str(img_widths[k]) +
+                ' columns gives ~' + str(n_shows) + ' shows (' + str(int(coverage*100)) + '% of columns), needs ' +
+                str(needed) + ' ms')
+            if adapt:
+                display_durs[k] = needed if max_dur is None else min(needed, max_dur)
+                print('--> display duration of strip ' + str(k+1) + ' set to ' + str(display_durs[k]) + ' ms')
+    return ok
+
+
+# Table of predicted coverage for every strip and image set
+def print_plan(costs, display_durs, image_sets, widths):
+    print('Predicted shows per sweep / column coverage:')
+    for s in range(len(image_sets)):
+        cells = []
+        for k in range(len(costs)):
+            if widths[s][k] is None:
+                cells.append('?')
+                continue
+            n_shows, coverage = predict(costs[k], display_durs[k], widths[s][k])
+            cells.append(str(n_shows) + '/' + str(int(coverage*100)) + '%')
+        print('--> set ' + str(s) + ': ' + ', '.join(cells))
@@ -0,0 +1,233 @@
+#!/usr/bin/python
+
+# --------------------------------------------------------------------------
+# Trial-list runner for scripted experiments.
+#
+# Reads a trial table (CSV, one row per trial), prepares every distinct
+# stimulus before the first trial and primes it with dark sweeps (see
+# priming.py), warns about every trial configuration whose durations cannot
+# show all columns (see throughput_planner.py, with plan_throughput), then runs all trials back to back through run_paint, without
+# keyboard polling. Timing of every presentation is written to a CSV file
+# in the gap after its trial, so an interrupted run keeps the trials done.
+#
+# Columns of the trial table (k = strip number, 1..n_strips):
+#   image_set      name or index of an image set of the interface (see
+#                  stimulus_catalog.py), or the file names of all strips
+#                  separated by '|'
+#   display_dur_k  presentation duration of strip k [ms]
+#   inter_dur_k    gap after strip k [ms]
+#   brightness_k   brightness of strip k [1..255]
+#   direction      1: left-to-right, 0: right-to-left (optional, default 1)
+#   mirror         1: right-to-left trials show the columns of each image in
+#                  reverse order (optional, default mirror_columns)
+#   fix_time       time after the trial [ms] (optional, default fix_time)
+# Instead of file names, procedural stimuli can be given (see
+# procedural_stimuli.py). Noise without a seed is generated fresh for every
+# trial, in the fix_time gap before it.
+# Missing per-strip columns fall back to the interface defaults.
+#
+# Usage: sudo python trial_runner.py trials.csv [results.csv]
+# --------------------------------------------------------------------------
+
+import sys
+import csv
+import time
+import collections
+import numpy as np
+import persistence_of_vision_interface as pvi
+from frame_bank import FrameBank, bank_width, sent_leds
+from monotonic_clock import monotonic
+from throughput_planner import calibrate_strip, check_plan
+from procedural_stimuli import is_procedural, parse_spec
+
+
+# Read the trial table into a list of dicts with parsed values
+def read_trials(filename, n_strips):
+    trials = []
+    with open(filename) as f:
+        for row in csv.DictReader(f):
+            trial = {}
+            image_set = row['image_set'].strip()
+            if image_set.isdigit():
+                trial['images'] = list(pvi.images[int(image_set)])
+            elif image_set in pvi.stimulus_catalog.sets:
+                trial['images'] = list(pvi.stimulus_catalog.sets[image_set])
+            else:
+                trial['images'] = [name.strip() for name in image_set.split('|')]
+            assert(len(trial['images']) == n_strips)
+            for name in trial['images']: # catch missing files before the first trial
+                problem = pvi.stimulus_catalog.check(name)
+                if problem:
+                    raise ValueError('Trial ' + str(len(trials)+1) + ': ' + name + ' ' + problem)
+            trial['display_durs'] = [float(row.get('display_dur_' + str(k+1)) or pvi.display_durs[k]) for k in range(n_strips)]
+            trial['inter_durs'] = [float(row.get('inter_dur_' + str(k+1)) or pvi.inter_durs[k]) for k in range(n_strips)]
+            trial['brightness'] = [int(row.get('brightness_' + str(k+1)) or pvi.brightness_config[k]) for k in range(n_strips)]
+            trial['direction'] = int(row.get('direction') or 1)
+            trial['mirror'] = int(row.get('mirror') or pvi.mirror_columns)
+            trial['fix_time'] = float(row.get('fix_time') or pvi.fix_time)
+            trials.append(trial)
+    return trials
+
+
+# Prepare every distinct (file, strip length, brightness) once. Identical
+# files under different names are shared through the stimulus registry.
+# With plan_throughput, every distinct trial configuration is checked.
+def preload_stimuli(trials, strips):
+    stimuli = {}
+    widths = {} # number of columns per prepared stimulus
+    for trial in trials:
+        for k in range(len(strips)):
+            key = (trial['images'][k], pvi.n_leds[k], trial['brightness'][k])
+            if key in stimuli:
+                continue
+            if is_procedural(trial['images'][k]):
+                if is_fresh(trial['images'][k]):
+                    stimuli[key] = None # generated right before its trial
+                    widths[key] = pvi.stimulus_width(trial['images'][k])
+                else:
+                    stimuli[key] = pvi.loadProcedural(trial['images'][k], pvi.n_leds[k], trial['brightness'][k])
+                    widths[key] = bank_width(stimuli[key])
+            else:
+                params = (pvi.n_leds[k], trial['brightness'][k], pvi.gamma, pvi.color_balance_factors,
+                    pvi.power_settings, pvi.color_order, pvi.vflip)
+                stimuli[key], img_width, registry_key = pvi.stimulus_registry.acquire(trial['images'][k], params,
+                    lambda: pvi.loadImage(trial['images'][k], strips[k], pvi.n_leds[k],
+                        trial['brightness'][k], pvi.gamma, pvi.color_balance_factors, pvi.power_settings,
+                        pvi.color_order, pvi.vflip))
+                widths[key] = img_width
+    print('Prepared ' + str(len(pvi.stimulus_registry)) + ' unique stimuli for ' + str(len(stimuli)) + ' slots')
+    if pvi.plan_throughput == 1 and trials:
+        check_trial_plans(trials, stimuli, widths, strips)
+    return stimuli
+
+
+# Warn about every distinct trial configuration (stimuli and durations) that
+# cannot show all columns. Show costs are calibrated with the first trial's
+# stimuli (dither() of LightPaint objects). Durations are not adapted: they
+# are part of the experiment.
+def check_trial_plans(trials, stimuli, widths, strips):
+    n_strips = len(strips)
+    first = [stimuli[(trials[0]['images'][k], pvi.n_leds[k], trials[0]['brightness'][k])] for k in range(n_strips)]
+    costs = [calibrate_strip(strips[k], pvi.n_leds[k], pvi.is_hardware_spi(pvi.pin_config[k]), first[k])
+        for k in range(n_strips)]
+    configs = collections.OrderedDict() # (slot keys, display durations) -> trial numbers
+    for trial_nr in range(len(trials)):
+        keys = tuple((trials[trial_nr]['images'][k], pvi.n_leds[k], trials[trial_nr]['brightness'][k]) for k in range(n_strips))
+        configs.setdefault((keys, tuple(trials[trial_nr]['display_durs'])), []).append(trial_nr+1)
+    for (keys, display_durs), trial_nrs in configs.items():
+        if None in [widths[key] for key in keys]:
+            continue # width unknown
+        sent = [sent_leds(stimuli[key]) if isinstance(stimuli[key], FrameBank) else None for key in keys]
+        if not check_plan(costs, list(display_durs), [widths[key] for key in keys], sent_leds=sent):
+            print('--> in trials ' + ', '.join(str(n) for n in trial_nrs))
+
+
+# One priming sweep per prepared stimulus: (strip, stimulus, display duration)
+def priming_slots(trials, stimuli):
+    slots = {}
+    for trial in trials:
+        for k in range(len(trial['images'])):
+            key = (trial['images'][k], pvi.n_leds[k], trial['brightness'][k])
+            if stimuli[key] is not None and not key in slots:
+                slots[key] = (k, stimuli[key], trial['display_durs'][k])
+    return list(slots.values())
+
+
+# Procedural stimuli that must be generated anew for every trial
+def is_fresh(name):
+    kind, params = parse_spec(name)
+    return kind == 'noise' and 'seed' not in params
+
+
+def prepare_fresh(trial):
+    fresh = {}
+    for k in range(len(trial['images'])):
+        if is_procedural(trial['images'][k]) and is_fresh(trial['images'][k]):
+            fresh[k] = pvi.loadProcedural(trial['images'][k], pvi.n_leds[k], trial['brightness'][k])
+    return fresh
+
+
+# Run all trials. One timing row per presentation is written to
+# results_file (see open_results) after every trial; returns all rows.
+def run_trials(trials, stimuli, strips, led_buffers, results_file):
+    f, writer = results_file
+    n_strips = len(strips)
+    results = []
+    fresh = prepare_fresh(trials[0]) if trials else {}
+    for trial_nr in range(len(trials)):
+        trial = trials[trial_nr]
+        if trial['direction'] == 1: # left-to-right presentation
+            order = list(range(n_strips))
+        else: # right-to-left presentation
+            order = list(range(n_strips-1, -1, -1))
+        reverse = (trial['mirror'] == 1 and trial['direction'] == 0)
+        trial_results = []
+        for k in order:
+            lightpaint = fresh.get(k)
+            if lightpaint is None:
+                lightpaint = stimuli[(trial['images'][k], pvi.n_leds[k], trial['brightness'][k])]
+            dur, delay = pvi.compensated_durs(k, trial['display_durs'][k]/1000.0, trial['inter_durs'][k]/1000.0)
+            onset = monotonic()
+            frame_times = pvi.run_paint(dur, delay, lightpaint, led_buffers[k], strips[k], reverse)
+            if pvi.duration_controller is not None:
+                pvi.duration_controller.update(k, trial['display_durs'][k]/1000.0, frame_times[-1])
+            if len(frame_times) > 2:
+                inter_frame_time = np.mean(np.diff(frame_times[0:len(frame_times)-1]))*1000
+            else:
+                inter_frame_time = 0
+            trial_results.append([trial_nr+1, k+1, trial['images'][k], trial['display_durs'][k], trial['inter_durs'][k],
+                trial['brightness'][k], trial['direction'], round(onset, 6), round(frame_times[-1]*1000, 3),
+                len(frame_times)-1, round(inter_frame_time, 3)])
+        # write the timing and generate fresh stimuli of the next trial in the gap
+        gap_start = monotonic()
+        writer.writerows(trial_results)
+        f.flush()
+        results.extend(trial_results)
+        fresh = prepare_fresh(trials[trial_nr+1]) if trial_nr+1 < len(trials) else {}
+        sleep_for_time = trial['fix_time']/1000.0 - (monotonic() - gap_start)
+        if sleep_for_time > 0:
+            time.sleep(sleep_for_time)
+    return results
+
+
+# Open the timing file and write its header: returns (file, csv writer)
+def open_results(filename):
+    f = open(filename, 'w')
+    writer = csv.writer(f)
+    writer.writerow(['trial', 'strip', 'file_name', 'display_dur', 'inter_dur', 'brightness', 'direction',
+        'onset', 'pres_dur', 'n_shows', 'inter_frame_time'])
+    f.flush()
+    return f, writer
+
+
+if __name__ == '__main__':
+    trial_file = sys.argv[1]
+    result_file = sys.argv[2] if len(sys.argv) > 2 else trial_file.replace('.csv', '') + '_timing.csv'
+
+    # set up strips like the interface does
+    strips = pvi.initialize_strips(pvi.n_leds, pvi.pin_config)
+    pvi.set_brightness(strips, pvi.brightness_config)
+    led_buffers = pvi.get_strip_buffer(strips)
+
+    # prepare everything before the first trial
+    pvi.load_stimulus_catalog()
+    trials = read_trials(trial_file, len(strips))
+    stimuli = preload_stimuli(trials, strips)
+    slots = priming_slots(trials, stimuli)
+    pvi.prime_sweeps(strips, led_buffers, slots, str(len(slots)) + ' trial stimuli')
+    pvi.start_duration_control(strips, led_buffers, slots)
+    strips = pvi.start_sync_events(strips)
+    print('Running ' + str(len(trials)) + ' trials...')
+
+    results_file = open_results(result_file)
+    try:
+        run_trials(trials, stimuli, strips, led_buffers, results_file)
+        pvi.print_duration_errors(len(trials))
+    finally:
+        results_file[0].close()
+        print('Timing written to: ' + result_file)
+        for strip in strips:
+            strip.clear()
+            strip.show()
+        if pvi.sync_events is not None:
+            pvi.sync_events.close()
@@ -0,0 +1,193 @@
+#!/usr/bin/python
+
+# --------------------------------------------------------------------------
+# Incremental hot-loading of stimuli from USB sticks.
+#
+# 99_lightpaint_mount sends SIGUSR1 to the painter when usbmount has mounted
+# a stick (and 99_lightpaint_umount sends SIGUSR2 on removal). The signal
+# handler only wakes up a background thread, which scans the mount points for
+# images, and copies every new or changed image (pre-resized to the strip
+# length, so that loading it later is cheap) into a local ingest directory.
+# While a stick is mounted, its directories are also watched with inotify, so
+# images copied onto it are picked up as well.
+#
+# A manifest (JSON) records every ingested source file with its size and
+# modification time and is saved after each file. Rescanning skips files that
+# are already done, so an interrupted ingest of a large stick simply resumes.
+# The display loop collects finished files with poll() in its gaps; it never
+# waits for the ingest.
+# --------------------------------------------------------------------------
+
+import os
+import json
+import errno
+import select
+import signal
+import struct
+import ctypes
+import ctypes.util
+import hashlib
+from PIL import Image
+from realtime_mode import background_thread
+try:
+    import queue # Python 3
+except ImportError:
+    import Queue as queue # Python 2
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.gif')
+IN_CLOSE_WRITE, IN_MOVED_TO = 0x00000008, 0x00000080
+_EVENT_HEADER = struct.Struct('iIII') # wd, mask, cookie, len
+
+
+# File name as bytes, as it is on disk (names on sticks need not be UTF-8)
+def path_bytes(path):
+    if isinstance(path, bytes): # Python 2 str
+        return path
+    if hasattr(os, 'fsencode'): # Python 3
+        return os.fsencode(path)
+    return path.encode('utf-8', 'replace')
+
+
+# Manifest key of a file name (JSON needs text)
+def manifest_key(path):
+    return path_bytes(path).decode('utf-8', 'replace')
+
+
+# Minimal inotify via ctypes (there is no inotify in the standard library)
+class _Inotify(object):
+    def __init__(self):
+        self._libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.fd = self._libc.inotify_init()
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init failed')
+        self.watches = {} # watch descriptor -> directory
+
+    def watch(self, directory):
+        if directory in self.watches.values():
+            return
+        wd = self._libc.inotify_add_watch(self.fd, path_bytes(directory), IN_CLOSE_WRITE | IN_MOVED_TO)
+        if wd >= 0:
+            self.watches[wd] = directory
+
+    # Directories in which files were written since the last call
+    def read_events(self):
+        directories = set()
+        try:
+            data = os.read(self.fd, 65536)
+        except OSError:
+            return directories
+        offset = 0
+        while offset + _EVENT_HEADER.size <= len(data):
+            wd, mask, cookie, length = _EVENT_HEADER.unpack_from(data, offset)
+            offset += _EVENT_HEADER.size + length
+            if wd in self.watches:
+                directories.add(self.watches[wd])
+        return directories
+
+
+class UsbIngest(object):
+    # mount_root: where usbmount mounts sticks, ingest_path: local copies,
+    # n_leds: strip length (images are pre-resized to it)
+    def __init__(self, mount_root, ingest_path, n_leds):
+        self.mount_root = mount_root
+        self.ingest_path = ingest_path
+        self.n_leds = n_leds
+        self.manifest_file = os.path.join(ingest_path, 'manifest.json')
+        self.manifest = {} # source path -> [size, mtime, local file]
+        self._requests = queue.Queue() # scan requests for the worker
+        self._ready = queue.Queue()    # local files ready for display
+        self._inotify = None
+        self._worker = background_thread(self._run)
+
+    def start(self):
+        try:
+            os.makedirs(self.ingest_path)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+        if os.path.exists(self.manifest_file):
+            with open(self.manifest_file) as f:
+                self.manifest = json.load(f)
+        # everything ingested in earlier sessions is available right away
+        for source in sorted(self.manifest):
+            local_file = os.path.join(self.ingest_path, self.manifest[source][2])
+            if os.path.exists(local_file):
+                self._ready.put(local_file)
+        try:
+            self._inotify = _Inotify()
+        except OSError:
+            print('--> USB ingest: no inotify, relying on SIGUSR1 only')
+        signal.signal(signal.SIGUSR1, self._on_mount)
+        signal.signal(signal.SIGUSR2, self._on_mount) # unmount: rescan what is left
+        self._worker.start()
+        self._requests.put(self.mount_root) # resume an interrupted ingest
+
+    # Signal handler: never does any work itself
+    def _on_mount(self, signum, frame):
+        self._requests.put(self.mount_root)
+
+    # Local files that finished ingesting since the last call (never blocks)
+    def poll(self):
+        new_files = []
+        while True:
+            try:
+                new_files.append(self._ready.get_nowait())
+            except queue.Empty:
+                return new_files
+
+    def _run(self):
+        while True:
+            # wait for a scan request, or for files written to a watched stick
+            try:
+                directory = self._requests.get(timeout=0.5)
+            except queue.Empty:
+                directory = None
+            directories = set([directory]) if directory else set()
+            if self._inotify is not None and self._inotify.watches:
+                readable = select.select([self._inotify.fd], [], [], 0)[0]
+                if readable:
+                    directories |= self._inotify.read_events()
+            for directory in directories:
+                self._scan(directory)
+
+    def _scan(self, directory):
+        for root, dirs, files in os.walk(directory):
+            if os.path.abspath(root).startswith(os.path.abspath(self.ingest_path)):
+                continue
+            if self._inotify is not None:
+                self._inotify.watch(root)
+            for name in sorted(files):
+                if name.lower().endswith(IMAGE_EXTENSIONS) and not name.startswith('.'):
+                    try:
+                        self._ingest(os.path.join(root, name))
+                    except (IOError, OSError, ValueError) as e: # one bad file never stops the ingest
+                        print('--> USB ingest: skipped ' + repr(os.path.join(root, name)) + ' (' + str(e) + ')')
+
+    def _ingest(self, source):
+        try:
+            stat = os.stat(source)
+        except OSError:
+            return # stick was removed
+        key = manifest_key(source)
+        done = self.manifest.get(key)
+        if done is not None and done[0] == stat.st_size and done[1] == stat.st_mtime:
+            return # already ingested and unchanged
+        try:
+            img = Image.open(source).convert('RGB')
+            if img.size[1] != self.n_leds: # same vertical scaling as loadImage
+                img = img.resize((img.size[0], self.n_leds), Image.BICUBIC)
+            base = manifest_key(os.path.splitext(os.path.basename(source))[0])
+            local_name = hashlib.sha1(path_bytes(source)).hexdigest()[0:12] + '_' + \
+                str(''.join(c if c.isalnum() and ord(c) < 128 else '_' for c in base)) + '.png' # ASCII only
+            local_file = os.path.join(self.ingest_path, local_name)
+            img.save(local_file + '.tmp', 'PNG')
+            os.rename(local_file + '.tmp', local_file)
+        except (IOError, OSError) as e:
+            print('--> USB ingest: skipped ' + repr(source) + ' (' + str(e) + ')')
+            return
+        # record progress right away, so an interrupted ingest resumes here
+        self.manifest[key] = [stat.st_size, stat.st_mtime, local_name]
+        with open(self.manifest_file + '.tmp', 'w') as f:
+            json.dump(self.manifest, f)
+        os.rename(self.manifest_file + '.tmp', self.manifest_file)
+        self._ready.put(local_file)